@@ -1,30 +1,36 @@
 # -*- coding: utf-8 -*-
-import io
+import gc
 import os
 import json
-import base64
-import datetime
-import requests
 import pathlib
-import math
 import pandas as pd
-import flask
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import plotly.plotly as py
-import plotly.graph_objs as go
-from sklearn.linear_model import LinearRegression
-import base64
-from dash.dependencies import Input, Output, State
+import plotly.utils
+from dash.dependencies import Input, Output, State, ClientsideFunction, MATCH, ALL
 from plotly import tools
 from utils_trace import *
+from utils_data import register_dataset, get_dataset, load_ref_table, read_upload, UploadError
+from utils_data import hash_upload, icv_norm_stage, resolve_columns, get_centile_index
+from utils_cache import LRUCache
+from utils_metrics import CallbackMetrics
+from utils_profile import RequestProfiler
+from utils_jobs import JobQueue, JOB_PENDING
+from utils_stats import get_linreg_table, lod_sample, has_centile_scores
 
 app = dash.Dash(
     __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}],
 )
 app.title = "NiChart"
 server = app.server
+
+## Latency / payload size / error metrics of all server callbacks (at /metrics)
+metrics = CallbackMetrics(app.callback_map)
+metrics.init_app(server)
+## On demand profiling of callback requests (see utils_profile)
+profiler = RequestProfiler()
+profiler.init_app(server)
 PATH = pathlib.Path(__file__).parent
 DATA_PATH1 = PATH.joinpath("data", "csv_data").resolve()
 DATA_PATH2 = PATH.joinpath("data", "reference_data", 'CENTILES').resolve()
@@ -32,7 +38,45 @@ DATA_PATH2 = PATH.joinpath("data", "reference_data", 'CENTILES').resolve()
 #####################################################
 ## Hard coded parameters
 ## FIXME : this part will be modified in final version
-NUM_PLOTS = 4
+## Number of plots displayed initially
+NUM_PLOTS = 1
+
+## Number of points above which plots are drawn with WebGL (in "auto" render mode)
+WEBGL_THRESHOLD = int(os.environ.get("NICHART_WEBGL_THRESHOLD", 5000))
+
+## Max number of points sent for a scatter plot (level of detail sampling of
+## the visible x window for larger datasets)
+LOD_MAX_POINTS = int(os.environ.get("NICHART_LOD_MAX_POINTS", 10000))
+
+## Plot types drawn from statistics of age bins (summaries whose size does 
+## not depend on the number of subjects, for cohorts too large to scatter)
+BINNED_TRACES = ["bar_trace", "box_trace", "violin_trace"]
+## Statistic of bar plots, and bin width (in units of the x variable)
+BAR_STATS = [
+    {"label": "mean ± SD", "value": "mean"},
+    {"label": "median (IQR)", "value": "median"},
+    {"label": "count", "value": "count"},
+]
+BIN_WIDTHS = [1, 2, 5, 10]
+BIN_WIDTH = 5
+
+## Caches for finished figures (main trace) and data layer traces 
+##  (limits of each cache can be set with env variables; 256 MB in all by default)
+fig_cache = LRUCache(
+    max_entries = int(os.environ.get("NICHART_FIG_CACHE_ENTRIES", 256)),
+    max_bytes = int(os.environ.get("NICHART_FIG_CACHE_MB", 128)) * 2**20,
+)
+layer_cache = LRUCache(
+    max_entries = int(os.environ.get("NICHART_LAYER_CACHE_ENTRIES", 512)),
+    max_bytes = int(os.environ.get("NICHART_LAYER_CACHE_MB", 128)) * 2**20,
+)
+
+## Slow data layers are computed by background jobs for datasets of more than
+## ASYNC_MIN_ROWS rows (the plot is drawn without them, and the layer is added 
+## when its job is done; plots poll their jobs every JOB_POLL_MS)
+jobs = JobQueue()
+ASYNC_MIN_ROWS = int(os.environ.get("NICHART_ASYNC_MIN_ROWS", 100000))
+JOB_POLL_MS = 1000
 
 ### Initial reference data files
 ###  csv files used as reference; users can upload additional ones
@@ -67,43 +111,145 @@ NUM_PLOTS = 4
 
 ## Initial reference data files
 ##  csv files used as reference; users can upload additional ones
+##  (read through the binary cache, see build_cache.py; data is kept in the
+##  server side registry, stores keep only handles)
 dsets_ref = {
-    "ISTAG_CN0": pd.read_csv(DATA_PATH2.joinpath("ISTAGING_Centiles_SelROIS_Init+Norm.csv")).to_dict('records'),
-    "ISTAG_AD+CN-CN": pd.read_csv(DATA_PATH2.joinpath("ISTAGING_CN+AD-CN_Centiles_SelROIS_All.csv")).to_dict('records'),
-    "ISTAG_AD+CN-AD": pd.read_csv(DATA_PATH2.joinpath("ISTAGING_CN+AD-AD_Centiles_SelROIS_All.csv")).to_dict('records'),
+    "ISTAG_CN0": register_dataset(load_ref_table(DATA_PATH2.joinpath("ISTAGING_Centiles_SelROIS_Init+Norm.csv")), "ISTAG_CN0"),
+    "ISTAG_AD+CN-CN": register_dataset(load_ref_table(DATA_PATH2.joinpath("ISTAGING_CN+AD-CN_Centiles_SelROIS_All.csv")), "ISTAG_AD+CN-CN"),
+    "ISTAG_AD+CN-AD": register_dataset(load_ref_table(DATA_PATH2.joinpath("ISTAGING_CN+AD-AD_Centiles_SelROIS_All.csv")), "ISTAG_AD+CN-AD"),
 }
 ## Initial user data files
 ##  csv files with user data; normally users will upload them
+def register_user_dataset(df, name, key=None, rois=None):
+    ''' Registers a user dataset (after the ICV normalization stage)
+        rois: ROIs to normalize (default: all MUSE volumes, see utils_data)
+    '''
+    df, derived = icv_norm_stage(df, rois=rois)
+    return register_dataset(df, name, key, derived)
+
 dsets_user = {
-    "Dset1": pd.read_csv(DATA_PATH1.joinpath("Dset1.csv"), index_col=0).to_dict('records'),
-    "Dset2": pd.read_csv(DATA_PATH1.joinpath("Dset2.csv"), index_col=0).to_dict('records'),
+    "Dset1": register_user_dataset(pd.read_csv(DATA_PATH1.joinpath("Dset1.csv"), index_col=0), "Dset1"),
+    "Dset2": register_user_dataset(pd.read_csv(DATA_PATH1.joinpath("Dset2.csv"), index_col=0), "Dset2"),
 }
 
 
 
 ## Get ROI names
-tmp_col = pd.DataFrame.from_dict(list(dsets_user.values())[0]).columns
+tmp_handle = list(dsets_user.values())[0]
+tmp_col = pd.Index(tmp_handle['columns'] + tmp_handle['derived'])
 ROI_NAMES = tmp_col[tmp_col.str.contains('MUSE')].tolist() + tmp_col[tmp_col.str.contains('SPARE')].tolist()
 NON_ROI_COLS = ['Age']
 
+def precompute_user_stats(df):
+    ''' Statistics computed once when a user dataset is loaded or uploaded
+    '''
+    for xvar in NON_ROI_COLS:
+        if xvar in df.columns:
+            get_linreg_table(df, xvar)
+
+for tmp_handle in dsets_user.values():
+    precompute_user_stats(get_dataset(tmp_handle))
+for tmp_handle in dsets_ref.values():
+    get_centile_index(get_dataset(tmp_handle))
+
 #####################################################
 
-## List of plot names
-plot_names = ["Plot" + str(i+1) for i in range(NUM_PLOTS)]
+## Plots are created on demand in the browser (from a template of the plot
+## layout); callbacks use pattern-matching ids, so their number does not
+## depend on the number of plots
+def plot_id(comp_type, index):
+    ''' Returns the id of a component of a plot
+    '''
+    return {"type": comp_type, "index": index}
+
+def plot_class_name(num_plots):
+    ''' Returns the class of a plot div according to the number of plots displayed
+        (same rule as in assets/clientside.js)
+    '''
+    if num_plots % 2 == 0:
+        return "chart-style six columns"
+    elif num_plots == 3:
+        return "chart-style four columns"
+    return "chart-style twelve columns"
+
+## Data layers (value: name of the trace function in utils_trace)
+##  reference layers are drawn under the main trace, user data layers over it
+##  (except background layers, drawn under all other traces)
+REF_DATA_LAYERS = [
+    {"label": "Percentiles", "value": "percentile_trace"},
+]
+USER_DATA_LAYERS = [
+    {"label": "Lin Reg", "value": "linreg_trace"},
+    {"label": "Lowess Reg", "value": "lowess_trace"},
+    {"label": "Centiles", "value": "centile_trace"},
+    {"label": "Density", "value": "density_trace"},
+]
+## User data layers computed relative to the selected reference data
+USER_LAYERS_WITH_REF = ["centile_trace"]
+## Slow layers, computed by background jobs for large datasets
+ASYNC_LAYERS = ["lowess_trace", "centile_trace"]
+## Layers drawn for the current view of the plot (visible window and size,
+## recomputed on zoom)
+VIEW_LAYERS = ["density_trace"]
+## Layers of data points, sampled like the scatter plot for datasets of more 
+## than LOD_MAX_POINTS rows (points of the visible x window, resampled on zoom)
+LOD_LAYERS = ["centile_trace"]
+BACKGROUND_LAYERS = ["density_trace"]
+LAYER_LABELS = {x["value"]: x["label"] for x in REF_DATA_LAYERS + USER_DATA_LAYERS}
+
+## Density layer: cells of about DENSITY_PX_PER_BIN pixels (the size of the 
+## plot is measured in the browser; DENSITY_DEFAULT_SIZE until it is known)
+DENSITY_PX_PER_BIN = 8
+DENSITY_MAX_BINS = 200
+DENSITY_DEFAULT_SIZE = [600, 400]
+
+def density_view(view):
+    ''' Returns the grid of the density layer for the view of a plot:
+        [[num. cells along x, along y], x range, y range] (ranges: None for the data range)
+        view: {"size": [width, height] (pixels), "x_range", "y_range"} or None
+    '''
+    view = view or {}
+    bins = [int(min(DENSITY_MAX_BINS, max(10, x // DENSITY_PX_PER_BIN))) 
+            for x in (view.get("size") or DENSITY_DEFAULT_SIZE)]
+    return [bins, view.get("x_range"), view.get("y_range")]
+
+def layer_kwargs(layer, dset_ref, view=None):
+    ''' Returns the extra arguments of a user data layer
+    '''
+    kwargs = {"dset_ref": dset_ref} if layer in USER_LAYERS_WITH_REF else {}
+    if layer in VIEW_LAYERS:
+        kwargs["bins"], kwargs["x_range"], kwargs["y_range"] = density_view(view)
+    if layer in LOD_LAYERS:
+        kwargs["max_points"], kwargs["x_range"] = LOD_MAX_POINTS, (view or {}).get("x_range")
+    return kwargs
 
 #####################################################
 ## Functions to create different parts of the dashboard
 
-def create_plot(dset_ref, dset_user, type_trace, type_refdatalayer, type_userdatalayer, xvar, yvar):
+def use_webgl(num_points, render_mode):
+    ''' Returns True if a plot should be drawn with WebGL traces
+        render_mode: "auto" (WebGL above WEBGL_THRESHOLD points), "svg" or "webgl"
+    '''
+    if render_mode == "auto":
+        return num_points > WEBGL_THRESHOLD
+    return render_mode == "webgl"
+
+def create_plot(dset_ref, dset_user, type_trace, type_refdatalayer, type_userdatalayer, xvar, yvar, 
+                render_mode="auto", x_range=None, bar_stat="mean", bin_width=BIN_WIDTH):
     ''' Create a figure for a single plot (generated using user selections)
+        x_range: visible x window, used to select the sample of points in large scatter plots
+        bar_stat: statistic of bar plots
+        bin_width: bin width of plots of age bin statistics (BINNED_TRACES)
     '''
 
     # Get data
-    if isinstance(dset_ref, pd.DataFrame) == False:
+    if dset_ref is not None and isinstance(dset_ref, pd.DataFrame) == False:
         dset_ref = pd.DataFrame.from_dict(dset_ref)
 
     if isinstance(dset_user, pd.DataFrame) == False:
         dset_user = pd.DataFrame.from_dict(dset_user)
+    ## Columns computed on demand (e.g. ICV normalized rois)
+    dset_user = resolve_columns(dset_user, [xvar, yvar])
 
     sel_ref_data_layers = []
     row = 1
@@ -127,16 +273,28 @@ def create_plot(dset_ref, dset_user, type_trace, type_refdatalayer, type_userdat
         vertical_spacing=0.12,
     )
 
+    gl = use_webgl(len(dset_user), render_mode)
+
     # Add ref layers 
     for sel_layer in sel_ref_data_layers:
-        fig = eval(sel_layer)(dset_ref, xvar, yvar, fig)
+        fig = eval(sel_layer)(dset_ref, xvar, yvar, fig, gl=gl)
 
     # Add main trace (style) to figure
-    fig.append_trace(eval(type_trace)(dset_user, xvar, yvar), 1, 1)
+    #  (large scatter plots are drawn from a sample of the points in the visible window)
+    dset_main = dset_user
+    if type_trace == "dots_trace" and len(dset_user) > LOD_MAX_POINTS:
+        dset_main = dset_user.iloc[lod_sample(dset_user, xvar, yvar, LOD_MAX_POINTS, x_range)]
+    #  (plots of age bin statistics may have several traces)
+    trace_kwargs = {"bin_width": bin_width} if type_trace in BINNED_TRACES else {}
+    if type_trace == "bar_trace":
+        trace_kwargs["stat"] = bar_stat
+    main_traces = eval(type_trace)(dset_main, xvar, yvar, gl=gl, **trace_kwargs)
+    for trace in (main_traces if isinstance(main_traces, list) else [main_traces]):
+        fig.append_trace(trace, 1, 1)
 
     # Add user data layers 
     for sel_layer in sel_user_data_layers:
-        fig = eval(sel_layer)(dset_user, xvar, yvar, fig)
+        fig = eval(sel_layer)(dset_user, xvar, yvar, fig, gl=gl, **layer_kwargs(sel_layer, dset_ref))
 
     fig["layout"][
         "uirevision"
@@ -154,44 +312,96 @@ def create_plot(dset_ref, dset_user, type_trace, type_refdatalayer, type_userdat
 
     return fig
 
-def create_div_plot(curr_plot):
+def create_layer_traces(dset, layer, xvar, yvar, gl=False, dset_ref=None, progress=None, view=None):
+    ''' Returns the list of traces of a single data layer
+        progress: optional function called with the completed fraction (layers in ASYNC_LAYERS)
+        view: view of the plot (layers in VIEW_LAYERS)
+    '''
+    fig = tools.make_subplots(rows=1, cols=1, print_grid=False)
+    kwargs = layer_kwargs(layer, dset_ref, view)
+    if progress is not None:
+        kwargs["progress"] = progress
+    return list(eval(layer)(dset, xvar, yvar, fig, gl=gl, **kwargs).data)
+
+def layer_precomputed(layer, dset, xvar, dset_ref):
+    ''' Checks if the slow part of a sampled layer is cached in this process (the
+        centile scores do not depend on the window, so once they are computed the
+        other windows are drawn at once)
+    '''
+    if layer == "centile_trace" and dset_ref is not None:
+        return has_centile_scores(dset, dset_ref, xvar)
+    return False
+
+def get_layer_traces(dset, layer, xvar, yvar, gl, dset_ref, view, sig, retry_failed=True):
+    ''' Returns (traces, None) for a data layer, or ([], job state) if its traces 
+        are computed by a background job that is not done yet
+        sig: signature of the layer inputs (key of the cached traces and of the job)
+    '''
+    cache_key = (layer,) + tuple(sig)
+    if (layer not in ASYNC_LAYERS or len(dset) <= ASYNC_MIN_ROWS or cache_key in layer_cache
+            or layer_precomputed(layer, dset, xvar, dset_ref)):
+        traces = layer_cache.get_or_create(
+            cache_key, lambda: create_layer_traces(dset, layer, xvar, yvar, gl, dset_ref, view=view)
+        )
+        return traces, None
+    job_key = json.dumps(cache_key)
+    job = jobs.submit(
+        job_key,
+        lambda progress: [x.to_plotly_json() for x in 
+                          create_layer_traces(dset, layer, xvar, yvar, gl, dset_ref, progress, view)],
+        retry_failed,
+    )
+    if job is not None and job["status"] == "done":
+        traces = jobs.result(job_key)
+        if traces is not None:
+            layer_cache.put(cache_key, traces)
+            return traces, None
+        job = jobs.get(job_key)
+    return [], dict(job or {"key": job_key, "status": "queued", "progress": 0, "error": None}, 
+                    label=LAYER_LABELS[layer])
+
+def create_div_plot(index, num_plots=1):
     ''' Returns html div for a single plot
+        (components have pattern-matching ids {"type": ..., "index": index})
     '''
     return html.Div(
-        id = curr_plot + "_graph_div",
+        id = plot_id("graph_div", index),
         
-        className="display-none",               ## This is used to make figure visible/non-visible
+        className=plot_class_name(num_plots),   ## This is used to set the size of the figure
         #className="chart-style six columns",
         
         children=[
             # Menu for the plot
             html.Div(
-                id = curr_plot + "menu",
+                id = plot_id("menu", index),
                 #className="not_visible",
                 className="visible",                
                 children=[
+                    # progress of the background jobs of the plot layers
+                    html.Div(
+                        id = plot_id("jobs_status", index),
+                        className="jobs-status",
+                    ),
                     # stores current menu tab
                     html.Div(
-                        id = curr_plot + "menu_tab",
+                        id = plot_id("menu_tab", index),
                         children=["LayersData"],
                         style={"display": "none"},
                     ),
 
                     html.Span(
                         "Reference Layers",
-                        id = curr_plot + "ref_data_layers_header",
+                        id = plot_id("ref_data_layers_header", index),
                         className="span-menu",
                         n_clicks_timestamp=1,
                     ),
                     # LayersData Checklist
                     html.Div(
-                        id = curr_plot + "ref_data_layers_tab",
+                        id = plot_id("ref_data_layers_tab", index),
                         children=[
                             dcc.Checklist(
-                                id = curr_plot + "ref_data_layers",
-                                options=[
-                                    {"label": "Percentiles", "value": "percentile_trace"},
-                                ],
+                                id = plot_id("ref_data_layers", index),
+                                options=REF_DATA_LAYERS,
                                 value=[],
                             )
                         ],
@@ -199,37 +409,63 @@ def create_div_plot(curr_plot):
                     ),
                     html.Span(
                         "Data Layers",
-                        id = curr_plot + "user_data_layers_header",
+                        id = plot_id("user_data_layers_header", index),
                         className="span-menu",
                         n_clicks_timestamp=1,
                     ),
                     # LayersData Checklist
                     html.Div(
-                        id = curr_plot + "user_data_layers_tab",
+                        id = plot_id("user_data_layers_tab", index),
                         children=[
                             dcc.Checklist(
-                                id = curr_plot + "user_data_layers",
-                                options=[
-                                    {"label": "Lin Reg", "value": "linreg_trace"},
-                                    {"label": "Lowess Reg", "value": "lowess_trace"},
-                                ],
+                                id = plot_id("user_data_layers", index),
+                                options=USER_DATA_LAYERS,
                                 value=[],
                             )
                         ],
                         style={"display": "none"},
                     ),
+                    html.Span(
+                        "Style",
+                        id = plot_id("style_header", index),
+                        className="span-menu",
+                        n_clicks_timestamp=1,
+                    ),
                     # Styles checklist
                     html.Div(
-                        id = curr_plot + "style_tab",
+                        id = plot_id("style_tab", index),
                         children=[
                             dcc.RadioItems(
-                                id=curr_plot + "plot_type",
+                                id = plot_id("plot_type", index),
                                 options=[
                                     {"label": "dots", "value": "dots_trace"},
                                     {"label": "bar", "value": "bar_trace"},
+                                    {"label": "box", "value": "box_trace"},
+                                    {"label": "violin", "value": "violin_trace"},
                                 ],
                                 value="dots_trace",
-                            )
+                            ),
+                            # Statistic of bar plots, and bin width of bar/box/violin plots
+                            dcc.RadioItems(
+                                id = plot_id("bar_stat", index),
+                                options=BAR_STATS,
+                                value="mean",
+                            ),
+                            dcc.RadioItems(
+                                id = plot_id("bin_width", index),
+                                options=[{"label": f"bins: {x}", "value": x} for x in BIN_WIDTHS],
+                                value=BIN_WIDTH,
+                            ),
+                            # Render mode (auto: WebGL for large datasets)
+                            dcc.RadioItems(
+                                id = plot_id("render_mode", index),
+                                options=[
+                                    {"label": "auto", "value": "auto"},
+                                    {"label": "svg", "value": "svg"},
+                                    {"label": "webgl", "value": "webgl"},
+                                ],
+                                value="auto",
+                            ),
                         ],
                     ),
                 ],
@@ -239,9 +475,9 @@ def create_div_plot(curr_plot):
                 className="row chart-top-bar",
                 children=[
                     html.Span(
-                        id = curr_plot + "_menu_button",
+                        id = plot_id("menu_button", index),
                         className="inline-block chart-title",
-                        children=f"{curr_plot} ☰",
+                        children=f"Plot{index} ☰",
                         n_clicks=0,
                     ),
                     # Dropdown and close button float right
@@ -253,7 +489,7 @@ def create_div_plot(curr_plot):
                                 children=[
                                     dcc.Dropdown(
                                         className="dropdown-roi",
-                                        id = curr_plot + "dropdown_plot_refdata",
+                                        id = plot_id("dropdown_plot_refdata", index),
                                         clearable=False,
                                         #placeholder="Reference Data",
                                     )
@@ -264,7 +500,7 @@ def create_div_plot(curr_plot):
                                 children=[
                                     dcc.Dropdown(
                                         className="dropdown-roi",
-                                        id = curr_plot + "dropdown_plot_userdata",
+                                        id = plot_id("dropdown_plot_userdata", index),
                                         clearable=False,
                                         #placeholder="User Data",
                                     )
@@ -275,7 +511,7 @@ def create_div_plot(curr_plot):
                                 children=[
                                     dcc.Dropdown(
                                         className="dropdown-roi",
-                                        id = curr_plot + "dropdown_xvar",
+                                        id = plot_id("dropdown_xvar", index),
                                         options=[
                                             {'label': i, 'value': i} for i in NON_ROI_COLS
                                         ],
@@ -290,7 +526,7 @@ def create_div_plot(curr_plot):
                                 children=[
                                     dcc.Dropdown(
                                         className="dropdown-roi",
-                                        id = curr_plot + "dropdown_yvar",
+                                        id = plot_id("dropdown_yvar", index),
                                         options=[
                                             {'label': i, 'value': i} for i in ROI_NAMES
                                         ],
@@ -301,7 +537,7 @@ def create_div_plot(curr_plot):
                                 ],
                             ),
                             html.Span(
-                                id = curr_plot + "_close",
+                                id = plot_id("close", index),
                                 className = "chart-close inline-block float-right",
                                 children = "×",
                                 n_clicks = 0,
@@ -313,11 +549,25 @@ def create_div_plot(curr_plot):
             # Graph div
             html.Div(
                 dcc.Graph(
-                    id = curr_plot + "chart",
+                    id = plot_id("chart", index),
                     className="chart-graph",
                     config={"displayModeBar": False, "scrollZoom": True},
                 )
             ),
+            # stores the visible x range of the graph
+            dcc.Store(id = plot_id("x_range", index), data = None),
+            # stores the view of the graph (visible x and y ranges, size of the plot area)
+            dcc.Store(id = plot_id("view", index), data = None),
+            # polls the background jobs of the data layers (enabled while a job is pending)
+            dcc.Interval(id = plot_id("jobs_interval", index), interval = JOB_POLL_MS, disabled = True),
+            # stores the figure with the main trace (and the signature of its inputs), 
+            #  and the traces of each data layer (the graph figure is assembled 
+            #  from these in the browser)
+            dcc.Store(id = plot_id("base_fig", index), data = None),
+            dcc.Store(id = plot_id("base_fig_sig", index), data = None),
+        ] + [
+            dcc.Store(id = plot_id(x["value"] + suffix, index), data = None)
+            for x in REF_DATA_LAYERS + USER_DATA_LAYERS for suffix in ["_traces", "_sig", "_job"]
         ],
     )
 
@@ -368,6 +618,7 @@ app.layout = html.Div(
                         # Allow multiple files to be uploaded
                         multiple=True
                     ),
+                    html.Div(id = 'upload_status_user'),
                     dcc.Store(id = 'store_data_ref', data = dsets_ref),
                 ]),
 
@@ -414,6 +665,7 @@ app.layout = html.Div(
                         # Allow multiple files to be uploaded
                         multiple=True
                     ),
+                    html.Div(id = 'upload_status_ref'),
                     dcc.Store(id = 'store_data_user', data = dsets_user),
                 ]),
 
@@ -465,16 +717,13 @@ app.layout = html.Div(
                 html.Div(
                     id="charts",
                     className="row",
-                    children=[create_div_plot(curr_plot) for curr_plot in plot_names],
+                    children=[create_div_plot(i + 1, NUM_PLOTS) for i in range(NUM_PLOTS)],
                 ),
             ],
         ),
 
-        # Hidden div that stores all clicked plots
-        html.Div(id="plots_visible_arr", children = ['Plot1'], style={"display": "none"}),
-
-        ## Hidden div that stores all clicked plots
-        #html.Div(id="plots_visible_arr", children = [], style={"display": "none"}),
+        # Template of the layout of a plot (new plots are created from it in the browser)
+        dcc.Store(id="plot_template", data=json.loads(json.dumps(create_div_plot(0), cls=plotly.utils.PlotlyJSONEncoder))),
         
     ],
 )
@@ -483,145 +732,120 @@ app.layout = html.Div(
 # Dynamic Callbacks
 ##########################################################################
 
-# Updates if plots are visible/non-visible (returns a list of active plots)
-def generate_change_plot_vis_callback():
-    def change_plot_vis_callback(*args):
-
-        changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
-        vis_arr = args[-1]
-
-        ## Add new plot
-        if 'new_plot_button' in changed_id:
-            for tmp_plot in plot_names:
-                if tmp_plot not in vis_arr:
-                    vis_arr = vis_arr + [tmp_plot]
-                    return vis_arr
-                    
-        ## Delete plot
-        #for i in range(1, len(plot_names)+1):
-        for i in range(0, len(plot_names)):
-            curr_plot = plot_names[i]
-            if curr_plot + "_close" in changed_id:
-                vis_arr = [x for x in vis_arr if x != curr_plot]
-        return vis_arr
-            
-    return change_plot_vis_callback
-
-# Function to update plot figure
-def generate_figure_callback(curr_plot):
-    def chart_fig_callback(plot_type, ref_data_layers, user_data_layers, 
-                           sel_ref_df, sel_user_df, 
-                           sel_xvar, sel_yvar, 
-                           data_store_ref, data_store_user):
-        
-        fig = tools.make_subplots(
-            rows=1,
-            shared_xaxes=True,
-            shared_yaxes=True,
-            cols=1,
-            print_grid=False,
-            vertical_spacing=0.12,
-        )
-        
-        if sel_ref_df is None:
-            return fig
+# Function to update plot figure (main trace)
+#  The figure is sent only if its inputs changed (a signature of the inputs is 
+#  kept in the browser): all callbacks of the existing plots run again when a 
+#  plot is added or removed, and must not resend their figure
+def generate_figure_callback():
+    def chart_fig_callback(plot_type, sel_user_df, 
+                           sel_xvar, sel_yvar, render_mode, x_range, bar_stat, bin_width,
+                           data_store_user, prev_sig):
         
         if sel_user_df is None:
-            return fig
-        
-        
-        curr_ref_dset = pd.DataFrame.from_dict(data_store_ref[sel_ref_df])
-        curr_user_dset = pd.DataFrame.from_dict(data_store_user[sel_user_df])
-        
-        if curr_ref_dset is None:
-            return {"layout": {}, "data": {}}
-
-
-        print('AAAAAAAAAAAAAA')
-        print(sel_xvar)
-        print(sel_yvar)
-        print(curr_user_dset.head())
+            return {"layout": {}, "data": []}, None
         
-
-        fig = create_plot(curr_ref_dset, curr_user_dset, 
-                          plot_type, ref_data_layers, user_data_layers, 
-                          sel_xvar, sel_yvar)
-        return fig
+        curr_user_dset = get_dataset(data_store_user.get(sel_user_df))
+        if curr_user_dset is None:
+            return {"layout": {}, "data": []}, None
+
+        ## Figures are cached on the inputs and the dataset hash
+        ## (the x window matters only if the points are sampled, the bin
+        ## options only for plots of age bin statistics)
+        gl = use_webgl(len(curr_user_dset), render_mode)
+        if plot_type != "dots_trace" or len(curr_user_dset) <= LOD_MAX_POINTS:
+            ## Zooming does not change a figure that is not sampled
+            triggered = [x['prop_id'] for x in dash.callback_context.triggered]
+            if len(triggered) > 0 and all(x.endswith('.data') for x in triggered):
+                raise dash.exceptions.PreventUpdate
+            x_range = None
+        if plot_type != "bar_trace":
+            bar_stat = "mean"
+        if plot_type not in BINNED_TRACES:
+            bin_width = BIN_WIDTH
+        cache_key = (data_store_user[sel_user_df]['hash'], plot_type, 
+                     sel_xvar, sel_yvar, gl, None if x_range is None else tuple(x_range),
+                     bar_stat, bin_width)
+        sig = json.dumps(cache_key)
+        if sig == prev_sig:
+            raise dash.exceptions.PreventUpdate
+        fig = fig_cache.get_or_create(
+            cache_key,
+            lambda: create_plot(None, curr_user_dset, plot_type, [], [], 
+                                sel_xvar, sel_yvar, "webgl" if gl else "svg", x_range,
+                                bar_stat, bin_width)
+        )
+        return fig, sig
 
     return chart_fig_callback
 
-
-# Function to open or close Style or LayersData menus
-def generate_open_close_menu_callback():
-    def open_close_menu(n, className):
-        if n == 0:
-            return "not_visible"
-        if className == "visible":
-            return "not_visible"
-        else:
-            return "visible"
-
-    return open_close_menu
-
-# Function for hidden div that stores the last clicked menu tab
-# Also updates style and user_data_layers menu headers
-def generate_active_menu_tab_callback():
-    def update_current_tab_name(n_ref_data_layers, n_user_data_layers):
-        if n_ref_data_layers == np.max([n_ref_data_layers, n_user_data_layers]):
-            return "LayersRef", "span-menu selected","span-menu"
-        else:
-            return "LayersData", "span-menu", "span-menu selected"
-
-    return update_current_tab_name
-
-
-# Function show or hide user_data_layers menu for chart
-def generate_user_data_layers_content_tab_callback():
-    def user_data_layers_content_tab_callback(current_tab):
-        if current_tab == "LayersData":
-            return {"display": "block", "textAlign": "left", "marginTop": "30"}
-        return {"display": "none"}
-
-    return user_data_layers_content_tab_callback
-
-# Function show or hide ref_data_layers menu for chart
-def generate_ref_data_layers_content_tab_callback():
-    def ref_data_layers_content_tab_callback(current_tab):
-        
-        if current_tab == "LayersRef":
-            return {"display": "block", "textAlign": "left", "marginTop": "30"}
-        return {"display": "none"}
-
-    return ref_data_layers_content_tab_callback
-
-# Function show or hide style menu for chart
-def generate_style_content_tab_callback():
-    def style_tab(current_tab):
-        if current_tab == "Style":
-            return {"display": "block", "textAlign": "left", "marginTop": "30"}
-        return {"display": "none"}
-
-    return style_tab
-
-# Resize plotting div according to the number of plots displayed
-def generate_plot_set_visibility_callback(curr_plot):
-    def plot_set_visibility_callback(plots_visible_arr):
-        if curr_plot not in plots_visible_arr:
-            return "display-none"
-        len_vis_plots = len(plots_visible_arr)
-        classes = "chart-style"
-        if len_vis_plots % 2 == 0:
-            classes = classes + " six columns"
-        elif len_vis_plots == 3:
-            classes = classes + " four columns"
-        else:
-            classes = classes + " twelve columns"
-        return classes
-    return plot_set_visibility_callback
-
+# Function to update the traces of a single data layer
+#  The layer sends new traces only if its own selection changed (a signature of 
+#  the layer inputs is kept in the browser), so toggling a layer does not resend
+#  the main trace or the other layers
+#  Slow layers of large datasets are sent empty while their background job runs
+#  (the job state is kept in the browser); the job is then polled on each tick 
+#  of the plot interval, and the traces are sent when it is done
+def generate_layer_callback(layer, is_ref):
+    def layer_callback(sel_layers, sel_ref_df, sel_user_df, 
+                       sel_xvar, sel_yvar, render_mode, n_intervals, view,
+                       data_store_ref, data_store_user, prev_sig, prev_job):
+
+        handle_user = data_store_user.get(sel_user_df) if sel_user_df is not None else None
+        handle_ref = data_store_ref.get(sel_ref_df) if sel_ref_df is not None else None
+        handle = handle_ref if is_ref else handle_user
+        ## Layers of user data may also depend on the reference data
+        with_ref = not is_ref and layer in USER_LAYERS_WITH_REF
+
+        sig = [False]
+        if layer in (sel_layers or []) and handle is not None and handle_user is not None:
+            gl = use_webgl(handle_user['nrows'], render_mode)
+            sig = [True, handle['hash'], sel_xvar, sel_yvar, gl]
+            if with_ref:
+                sig.append(handle_ref['hash'] if handle_ref is not None else None)
+            if layer in VIEW_LAYERS:
+                sig.append(json.dumps(density_view(view)))
+            if layer in LOD_LAYERS:
+                x_range = (view or {}).get("x_range") if handle_user['nrows'] > LOD_MAX_POINTS else None
+                sig.append(json.dumps(x_range))
+
+        triggered = [x['prop_id'] for x in dash.callback_context.triggered]
+        polling = len(triggered) > 0 and all(x.endswith('.n_intervals') for x in triggered)
+        if polling:
+            ## Only a layer with a pending job for its current selection is updated
+            if prev_job is None or prev_job['status'] not in JOB_PENDING or sig != prev_sig:
+                raise dash.exceptions.PreventUpdate
+        elif sig == prev_sig:
+            raise dash.exceptions.PreventUpdate
+
+        traces, job = [], None
+        if sig[0]:
+            dset = get_dataset(handle)
+            dset_ref = get_dataset(handle_ref) if with_ref and handle_ref is not None else None
+            if dset is not None and not is_ref:
+                dset = resolve_columns(dset, [sel_xvar, sel_yvar])
+            if dset is not None:
+                ## (a failed job is started again only if the selection changed)
+                traces, job = get_layer_traces(dset, layer, sel_xvar, sel_yvar, gl, dset_ref, view,
+                                               sig[1:], not polling)
+        if polling and job is not None:
+            if job == prev_job:
+                raise dash.exceptions.PreventUpdate
+            return dash.no_update, dash.no_update, job
+        position = "background" if layer in BACKGROUND_LAYERS else "under" if is_ref else "over"
+        return {"position": position, "traces": traces}, sig, job
+
+    return layer_callback
+
+
+# Function to update a dataset list
+#  The selected dataset is kept if it is still in the list: the callbacks of a 
+#  plot run again each time a plot is added or removed (the list of plots is 
+#  sent again), and the selection of the existing plots must not change
 def generate_uploaded_dfs_callback():
-    def uploaded_dfs_callback(dict_dfs):
+    def uploaded_dfs_callback(dict_dfs, curr_val):
         dict_options =  [{'label': i, 'value': i} for i in dict_dfs.keys()]
+        if curr_val in dict_dfs:
+            return dict_options, dash.no_update
         sel_val = list(dict_dfs.keys())[0]
         return dict_options, sel_val
     return uploaded_dfs_callback
@@ -629,15 +853,17 @@ def generate_uploaded_dfs_callback():
 
 
 #######################################################
-# Updates if a plot is visible/non-visible
-# - "new plot button" clicked: make the first non-visible plot visible
-# - "delete button" (x) on a plot is clicked: make the plot non-visible
-app.callback(
-    Output("plots_visible_arr", "children"), 
-    [Input("new_plot_button", "n_clicks")] + 
-    [Input(curr_plot + "_close", "n_clicks") for curr_plot in plot_names],
-    [State("plots_visible_arr", "children")], 
-)(generate_change_plot_vis_callback())
+# Adds or removes plots (runs in the browser, see assets/clientside.js)
+# - "new plot button" clicked: add a new plot (from the plot template)
+# - "delete button" (x) on a plot is clicked: remove the plot
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="add_remove_plot"),
+    Output("charts", "children"), 
+    [Input("new_plot_button", "n_clicks"), 
+     Input(plot_id("close", ALL), "n_clicks")],
+    [State("charts", "children"),
+     State("plot_template", "data")], 
+)
 #######################################################
 
 
@@ -645,46 +871,67 @@ app.callback(
 # Upload data files
 ### Read uploaded dfs
 def parse_contents(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    ''' Returns (df, None), or (None, error dict) if the file could not be read
+    '''
     try:
-        if 'csv' in filename:
-            # Assume that the user uploaded a CSV file
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-            
-    except Exception as e:
-        return None
-
-    df = df.to_dict(orient='records')
-    return df
+        return read_upload(contents, filename), None
+    except UploadError as e:
+        return None, e.to_dict(filename)
 
 ## Upload files
-def generate_upload_data_callback():
+##  Datasets are identified by the hash of the file content:
+##  - a file already in the store (under any name) is not added again
+##  - a file parsed before (by any session or worker) is taken from the registry
+##  - a new file with the name of a stored one gets a suffix
+def unique_name(name, store_data):
+    new_name, i = name, 2
+    while new_name in store_data.keys():
+        new_name, i = f"{name} ({i})", i + 1
+    return new_name
+
+def generate_upload_data_callback(register=register_dataset, precompute=None):
     def upload_data_callback(list_of_names, list_of_contents, store_data):
         ## Initialize empty dictionary for the storage
         if store_data is None:
             store_data = {}
         
-        ## Read data files
-        dfs = []
+        ## Read data files one at a time and add them to storage
+        msgs = []
         if list_of_contents is not None:
-            dfs = [parse_contents(c, n) for c, n in zip(list_of_contents, list_of_names)]
-
-        ## Add dfs to storage
-        for i, tmp_df in enumerate(dfs):
-            if tmp_df is not None:                
-                tmp_name = list_of_names[i]
-                if tmp_name in store_data.keys():
-                    print('Warning: file already in storage, skipping !')
-                else:
-                    store_data[tmp_name] = tmp_df
+            stored_keys = {v['hash']: k for k, v in store_data.items()}
+            for tmp_contents, tmp_name in zip(list_of_contents, list_of_names):
+                try:
+                    tmp_key = hash_upload(tmp_contents)
+                except UploadError as e:
+                    msgs.append(e.to_dict(tmp_name))
+                    continue
+                if tmp_key in stored_keys:
+                    if stored_keys[tmp_key] != tmp_name:
+                        msgs.append({'filename': tmp_name, 'code': 'duplicate', 
+                                     'message': 'same data already loaded as ' + stored_keys[tmp_key]})
+                    continue
+                ## (files in the cache dir that cannot be read are parsed again)
+                tmp_df = get_dataset({'hash': tmp_key})
+                if tmp_df is None:
+                    tmp_df, tmp_err = parse_contents(tmp_contents, tmp_name)
+                    if tmp_err is not None:
+                        print('Warning: could not read uploaded file: ', tmp_err)
+                        msgs.append(tmp_err)
+                        continue
+                tmp_name = unique_name(tmp_name, store_data)
+                store_data[tmp_name] = register(tmp_df, tmp_name, tmp_key)
+                stored_keys[tmp_key] = tmp_name
+                if precompute is not None:
+                    precompute(tmp_df)
         
-        ## Return stored data
-        return store_data
+        ## Return stored data and upload messages
+        msgs = [html.Div(f"{e['filename']}: {e['message']}", className="upload-message") for e in msgs]
+        return store_data, msgs
     return upload_data_callback
         
 app.callback(
-    Output("store_data_ref", "data"),
+    [Output("store_data_ref", "data"),
+     Output("upload_status_ref", "children")],
     [
         Input("upload_data_ref", "filename"),
         Input("upload_data_ref", "contents"),
@@ -695,7 +942,8 @@ app.callback(
 )(generate_upload_data_callback())
 
 app.callback(
-    Output("store_data_user", "data"),
+    [Output("store_data_user", "data"),
+     Output("upload_status_user", "children")],
     [
         Input("upload_data_user", "filename"),
         Input("upload_data_user", "contents"),
@@ -703,7 +951,7 @@ app.callback(
     [
         State("store_data_user", "data"),
     ],
-)(generate_upload_data_callback())
+)(generate_upload_data_callback(register_user_dataset, precompute_user_stats))
 #######################################################
 
 
@@ -715,6 +963,7 @@ app.callback(
     [
         Input("store_data_ref", "data"),
     ],
+    [State("dropdown_data_ref", "value")],
 )(generate_uploaded_dfs_callback())
 
 app.callback(
@@ -723,95 +972,162 @@ app.callback(
     [
         Input("store_data_user", "data"),
     ],
+    [State("dropdown_data_user", "value")],
 )(generate_uploaded_dfs_callback())
 #######################################################
 
 
 ######################################################
-# Loop through all plots
-for curr_plot in plot_names:
-    
-    ## Callback to make plot visible/invisible
-    ## - This is done by modifying the className property of the plot
-    ## - className sets the style to display the plot and is defined in the css  
-    app.callback(
-        Output(curr_plot + "_graph_div", "className"), 
-        [Input("plots_visible_arr", "children")]
-    )(generate_plot_set_visibility_callback(curr_plot))
-    
-    # Callback to update the plot drawing
-    app.callback(
-        Output(curr_plot + "chart", "figure"),
-        [
-            Input(curr_plot + "plot_type", "value"),
-            Input(curr_plot + "ref_data_layers", "value"),            
-            Input(curr_plot + "user_data_layers", "value"),            
-            Input(curr_plot + "dropdown_plot_refdata", "value"),
-            Input(curr_plot + "dropdown_plot_userdata", "value"),
-            Input(curr_plot + "dropdown_xvar", "value"),
-            Input(curr_plot + "dropdown_yvar", "value"),
-        ],
-        [
-            State('store_data_ref', 'data'),            
-            State('store_data_user', 'data'),            
-        ],
-    )(generate_figure_callback(curr_plot))
-
-    # Show or hide graph menu
-    app.callback(
-        Output(curr_plot + "menu", "className"),
-        [Input(curr_plot + "_menu_button", "n_clicks")],
-        [State(curr_plot + "menu", "className")],
-    )(generate_open_close_menu_callback())
-
-    # Callback to update menu and header visibility for a plot
-    app.callback(
-        [
-            Output(curr_plot + "menu_tab", "children"),
-            Output(curr_plot + "ref_data_layers_header", "className"),
-            Output(curr_plot + "user_data_layers_header", "className"),
-        ],
-        [
-            Input(curr_plot + "ref_data_layers_header", "n_clicks_timestamp"),
-            Input(curr_plot + "user_data_layers_header", "n_clicks_timestamp"),
-        ],
-    )(generate_active_menu_tab_callback())
-
-    # Callback to hide/show STYLE tab content
-    app.callback(
-        Output(curr_plot + "style_tab", "style"),
-        [Input(curr_plot + "menu_tab", "children")]
-    )(generate_style_content_tab_callback())
-
-    # Callback to hide/show MENU tab content
-    app.callback(
-        Output(curr_plot + "ref_data_layers_tab", "style"), 
-        [Input(curr_plot + "menu_tab", "children")]
-    )(generate_ref_data_layers_content_tab_callback())
+# Callbacks for all plots (pattern-matching ids)
     
-    # Callback to hide/show MENU tab content
-    app.callback(
-        Output(curr_plot + "user_data_layers_tab", "style"), 
-        [Input(curr_plot + "menu_tab", "children")]
-    )(generate_user_data_layers_content_tab_callback())
-
-    app.callback(
-        [Output(curr_plot + "dropdown_plot_refdata", "options"),
-         Output(curr_plot + "dropdown_plot_refdata", "value")],
-        [
-            Input("store_data_ref", "data"),
-        ],
-    )(generate_uploaded_dfs_callback())
+# Callback to keep track of the visible x range (zoom/pan)
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="update_x_range"),
+    Output(plot_id("x_range", MATCH), "data"),
+    [Input(plot_id("chart", MATCH), "relayoutData")],
+    [State(plot_id("x_range", MATCH), "data")],
+)
 
-    app.callback(
-        [Output(curr_plot + "dropdown_plot_userdata", "options"),
-         Output(curr_plot + "dropdown_plot_userdata", "value")],
-        [
-            Input("store_data_user", "data"),
-        ],
-    )(generate_uploaded_dfs_callback())
+# Callback to keep track of the view of the graph (x and y ranges, size)
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="update_view"),
+    Output(plot_id("view", MATCH), "data"),
+    [Input(plot_id("chart", MATCH), "relayoutData")],
+    [State(plot_id("view", MATCH), "data")],
+)
+
+# Callback to update the plot drawing (main trace)
+app.callback(
+    [Output(plot_id("base_fig", MATCH), "data"),
+     Output(plot_id("base_fig_sig", MATCH), "data")],
+    [
+        Input(plot_id("plot_type", MATCH), "value"),
+        Input(plot_id("dropdown_plot_userdata", MATCH), "value"),
+        Input(plot_id("dropdown_xvar", MATCH), "value"),
+        Input(plot_id("dropdown_yvar", MATCH), "value"),
+        Input(plot_id("render_mode", MATCH), "value"),
+        Input(plot_id("x_range", MATCH), "data"),
+        Input(plot_id("bar_stat", MATCH), "value"),
+        Input(plot_id("bin_width", MATCH), "value"),
+    ],
+    [
+        State('store_data_user', 'data'),            
+        State(plot_id("base_fig_sig", MATCH), "data"),
+    ],
+)(generate_figure_callback())
+
+# Callbacks to update the traces of each data layer
+#  (the view of the plot is an input of the layers drawn for the current view
+#  or sampled, a state of the others; it is the same argument of the callback)
+for sel_layers, layer_opts in [("ref_data_layers", REF_DATA_LAYERS), ("user_data_layers", USER_DATA_LAYERS)]:
+    for layer in [x["value"] for x in layer_opts]:
+        is_view = layer in VIEW_LAYERS + LOD_LAYERS
+        view_input = [Input(plot_id("view", MATCH), "data")] if is_view else []
+        view_state = [] if is_view else [State(plot_id("view", MATCH), "data")]
+        app.callback(
+            [
+                Output(plot_id(layer + "_traces", MATCH), "data"),
+                Output(plot_id(layer + "_sig", MATCH), "data"),
+                Output(plot_id(layer + "_job", MATCH), "data"),
+            ],
+            [
+                Input(plot_id(sel_layers, MATCH), "value"),
+                Input(plot_id("dropdown_plot_refdata", MATCH), "value"),
+                Input(plot_id("dropdown_plot_userdata", MATCH), "value"),
+                Input(plot_id("dropdown_xvar", MATCH), "value"),
+                Input(plot_id("dropdown_yvar", MATCH), "value"),
+                Input(plot_id("render_mode", MATCH), "value"),
+                Input(plot_id("jobs_interval", MATCH), "n_intervals"),
+            ] + view_input,
+            view_state + [
+                State('store_data_ref', 'data'),            
+                State('store_data_user', 'data'),            
+                State(plot_id(layer + "_sig", MATCH), "data"),
+                State(plot_id(layer + "_job", MATCH), "data"),
+            ],
+        )(generate_layer_callback(layer, sel_layers == "ref_data_layers"))
+
+# Callback to assemble the graph figure from the main trace and the data layers
+#  (runs in the browser, see assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="merge_figure"),
+    Output(plot_id("chart", MATCH), "figure"),
+    [Input(plot_id("base_fig", MATCH), "data")] + 
+    [Input(plot_id(x["value"] + "_traces", MATCH), "data") for x in REF_DATA_LAYERS + USER_DATA_LAYERS],
+)
+
+# Callback to show the progress of the background jobs of the data layers, and
+#  to poll them while one is pending (runs in the browser, see assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="job_status"),
+    [Output(plot_id("jobs_interval", MATCH), "disabled"),
+     Output(plot_id("jobs_status", MATCH), "children")],
+    [Input(plot_id(x["value"] + "_job", MATCH), "data") for x in REF_DATA_LAYERS + USER_DATA_LAYERS],
+)
+
+## UI only callbacks (run in the browser, see assets/clientside.js)
+# Show or hide graph menu
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="open_close_menu"),
+    Output(plot_id("menu", MATCH), "className"),
+    [Input(plot_id("menu_button", MATCH), "n_clicks")],
+)
+
+# Callback to update menu and header visibility for a plot
+app.clientside_callback(
+    ClientsideFunction(namespace="nichart", function_name="active_menu_tab"),
+    [
+        Output(plot_id("menu_tab", MATCH), "children"),
+        Output(plot_id("ref_data_layers_header", MATCH), "className"),
+        Output(plot_id("user_data_layers_header", MATCH), "className"),
+        Output(plot_id("style_header", MATCH), "className"),
+    ],
+    [
+        Input(plot_id("ref_data_layers_header", MATCH), "n_clicks_timestamp"),
+        Input(plot_id("user_data_layers_header", MATCH), "n_clicks_timestamp"),
+        Input(plot_id("style_header", MATCH), "n_clicks_timestamp"),
+    ],
+)
+
+# Callbacks to hide/show STYLE and MENU tab contents
+for tab_name, tab_id in [("Style", "style_tab"), ("LayersRef", "ref_data_layers_tab"), 
+                         ("LayersData", "user_data_layers_tab")]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="nichart", function_name="tab_" + tab_name),
+        Output(plot_id(tab_id, MATCH), "style"),
+        [Input(plot_id("menu_tab", MATCH), "children")]
+    )
+
+# Callbacks to update the dataset lists of a plot
+app.callback(
+    [Output(plot_id("dropdown_plot_refdata", MATCH), "options"),
+     Output(plot_id("dropdown_plot_refdata", MATCH), "value")],
+    [
+        Input("store_data_ref", "data"),
+    ],
+    [State(plot_id("dropdown_plot_refdata", MATCH), "value")],
+)(generate_uploaded_dfs_callback())
+
+app.callback(
+    [Output(plot_id("dropdown_plot_userdata", MATCH), "options"),
+     Output(plot_id("dropdown_plot_userdata", MATCH), "value")],
+    [
+        Input("store_data_user", "data"),
+    ],
+    [State(plot_id("dropdown_plot_userdata", MATCH), "value")],
+)(generate_uploaded_dfs_callback())
     
 ######################################################
 
+## Shared data
+##  With gunicorn --preload (see Procfile), this module is imported once in the
+##  master process and the workers are forked from it: the initial datasets,
+##  their derived data and the imported modules are shared (copy-on-write)
+##  instead of being loaded by each worker. Objects created so far are moved to
+##  the permanent generation of the garbage collector, so that collections in
+##  the workers do not write to (and copy) the pages holding them.
+gc.collect()
+gc.freeze()
+
 if __name__ == "__main__":
     app.run_server(debug=True)
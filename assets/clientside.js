@@ -0,0 +1,202 @@
+// Clientside callbacks (run in the browser, without a server round trip)
+
+// Style of a menu tab content (shown if it is the current tab)
+function tab_style(current_tab, tab_name) {
+    if (Array.isArray(current_tab)) {
+        current_tab = current_tab[0];
+    }
+    if (current_tab === tab_name) {
+        return {display: "block", textAlign: "left", marginTop: "30"};
+    }
+    return {display: "none"};
+}
+
+// Class of a plot div according to the number of plots displayed
+// (same rule as plot_class_name in app.py)
+function plot_class_name(num_plots) {
+    if (num_plots % 2 === 0) {
+        return "chart-style six columns";
+    }
+    if (num_plots === 3) {
+        return "chart-style four columns";
+    }
+    return "chart-style twelve columns";
+}
+
+// Copy of the plot template with all component ids set to the plot index
+function new_plot(template, index) {
+    var plot = JSON.parse(JSON.stringify(template));
+    (function set_index(x) {
+        if (Array.isArray(x)) {
+            x.forEach(set_index);
+        } else if (x && typeof x === "object") {
+            if (x.props) {
+                if (x.props.id && typeof x.props.id === "object") {
+                    x.props.id.index = index;
+                }
+                if (x.props.id && x.props.id.type === "menu_button") {
+                    x.props.children = "Plot" + index + " \u2630";
+                }
+                set_index(x.props.children);
+            }
+        }
+    })(plot);
+    return plot;
+}
+
+// Range of an axis ("xaxis" or "yaxis") from the relayoutData of a graph
+// (null for autorange, or the previous range if the axis did not change)
+function get_axis_range(relayout_data, axis, range) {
+    if (!relayout_data) {
+        return range;
+    }
+    if (axis + ".range[0]" in relayout_data && axis + ".range[1]" in relayout_data) {
+        return [relayout_data[axis + ".range[0]"], relayout_data[axis + ".range[1]"]];
+    }
+    if (axis + ".range" in relayout_data) {
+        return relayout_data[axis + ".range"].slice();
+    }
+    if (relayout_data[axis + ".autorange"]) {
+        return null;
+    }
+    return range;
+}
+
+// x axis range from the relayoutData of a graph
+function get_x_range(relayout_data, x_range) {
+    return get_axis_range(relayout_data, "xaxis", x_range);
+}
+
+// Size in pixels of the plot area of a graph (rounded to 50 px, so that
+// small resizes keep the same size), or null if it is not drawn yet
+function get_plot_size(graph_id) {
+    var el = graph_id ? document.getElementById(graph_id) : null;
+    var gd = el && (el.classList.contains("js-plotly-plot") ? el : el.querySelector(".js-plotly-plot"));
+    if (!gd || !gd._fullLayout || !gd._fullLayout._size) {
+        return null;
+    }
+    var size = gd._fullLayout._size;
+    return [Math.round(size.w / 50) * 50, Math.round(size.h / 50) * 50];
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    nichart: {
+        // Assembles a graph figure from the figure with the main trace and the
+        // traces of the data layers ({position: "background" | "under" | "over", traces: [...]})
+        merge_figure: function(base_fig) {
+            if (!base_fig) {
+                return {data: [], layout: {}};
+            }
+            var layers = Array.prototype.slice.call(arguments, 1).filter(function(x) { return x; });
+            var traces = {background: [], under: [], over: []};
+            layers.forEach(function(x) {
+                Array.prototype.push.apply(traces[x.position] || traces.over, x.traces || []);
+            });
+            return {
+                data: traces.background.concat(traces.under, base_fig.data || [], traces.over),
+                layout: base_fig.layout || {}
+            };
+        },
+
+        // Progress of the background jobs of the data layers of a plot (job
+        // states {label, status, progress, error}); only pending and failed
+        // jobs are shown, and the plot interval polls the jobs while one of
+        // them is pending
+        job_status: function() {
+            var jobs = Array.prototype.slice.call(arguments).filter(function(x) { return x; });
+            var pending = jobs.filter(function(x) {
+                return x.status === "queued" || x.status === "running";
+            });
+            var failed = jobs.filter(function(x) { return x.status === "failed"; });
+            var lines = pending.concat(failed).map(function(x) {
+                if (x.status === "failed") {
+                    return x.label + ": failed (" + x.error + ")";
+                }
+                return x.label + ": " + Math.round(100 * (x.progress || 0)) + "%";
+            });
+            return [pending.length === 0, lines.join(", ")];
+        },
+
+        // Adds a plot (a copy of the plot template) or removes the plot whose
+        // close button was clicked; plots are resized to fit the grid
+        add_remove_plot: function(n_new, n_close, charts, template) {
+            var ctx = window.dash_clientside.callback_context;
+            var triggered = ctx.triggered.length ? ctx.triggered[0] : null;
+            if (!triggered || !triggered.value) {
+                return window.dash_clientside.no_update;
+            }
+            charts = (charts || []).slice();
+            var prop_id = triggered.prop_id.slice(0, triggered.prop_id.lastIndexOf("."));
+            if (prop_id === "new_plot_button") {
+                var index = charts.reduce(function(m, x) {
+                    return Math.max(m, x.props.id.index);
+                }, 0) + 1;
+                charts.push(new_plot(template, index));
+            } else {
+                var index = JSON.parse(prop_id).index;
+                charts = charts.filter(function(x) { return x.props.id.index !== index; });
+            }
+            var className = plot_class_name(charts.length);
+            return charts.map(function(x) {
+                var props = Object.assign({}, x.props, {className: className});
+                return Object.assign({}, x, {props: props});
+            });
+        },
+
+        // Visible x range of a graph from its relayoutData (null for autorange)
+        update_x_range: function(relayout_data, x_range) {
+            var new_x_range = get_x_range(relayout_data, x_range);
+            if (JSON.stringify(new_x_range) === JSON.stringify(x_range)) {
+                return window.dash_clientside.no_update;
+            }
+            return new_x_range;
+        },
+
+        // Keeps track of the view of a graph: visible x and y ranges, and
+        // size of the plot area (read from the graph element)
+        update_view: function(relayout_data, view) {
+            var ctx = window.dash_clientside.callback_context;
+            var prop_id = ctx.triggered.length ? ctx.triggered[0].prop_id : "";
+            view = view || {x_range: null, y_range: null, size: null};
+            var new_view = {
+                x_range: get_axis_range(relayout_data, "xaxis", view.x_range),
+                y_range: get_axis_range(relayout_data, "yaxis", view.y_range),
+                size: get_plot_size(prop_id.slice(0, prop_id.lastIndexOf("."))) || view.size
+            };
+            if (JSON.stringify(new_view) === JSON.stringify(view)) {
+                return window.dash_clientside.no_update;
+            }
+            return new_view;
+        },
+
+        // Opens or closes the menu of a plot (open after an odd number of clicks;
+        // the state is derived from the clicks only, as the callback runs again
+        // each time a plot is added or removed)
+        open_close_menu: function(n) {
+            return (n || 0) % 2 === 1 ? "visible" : "not_visible";
+        },
+
+        // Stores the last clicked menu tab, and updates the menu headers
+        active_menu_tab: function(n_ref_data_layers, n_user_data_layers, n_style) {
+            var n_max = Math.max(n_ref_data_layers, n_user_data_layers, n_style);
+            if (n_style === n_max && n_style > 1) {
+                return ["Style", "span-menu", "span-menu", "span-menu selected"];
+            }
+            if (n_ref_data_layers === n_max) {
+                return ["LayersRef", "span-menu selected", "span-menu", "span-menu"];
+            }
+            return ["LayersData", "span-menu", "span-menu selected", "span-menu"];
+        },
+
+        // Show or hide the contents of the menu tabs
+        tab_Style: function(current_tab) {
+            return tab_style(current_tab, "Style");
+        },
+        tab_LayersRef: function(current_tab) {
+            return tab_style(current_tab, "LayersRef");
+        },
+        tab_LayersData: function(current_tab) {
+            return tab_style(current_tab, "LayersData");
+        }
+    }
+});
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+''' Benchmark of server callback volume for UI interactions
+
+    python benchmarks/bench_callbacks.py
+
+    Counts server and clientside callbacks in the app, and for typical UI
+    interactions the number of server requests they trigger (following the
+    callback graph from the changed property). Also times a trivial server
+    callback with the Flask test client, as an estimate of the server time
+    spent per request.
+
+    Plot components have pattern-matching ids ({"type": ..., "index": ...});
+    their properties are referred to as "type.prop" (for any plot), and the
+    counts of per-plot callbacks are for one plot.
+'''
+import sys
+import json
+import time
+import pathlib
+import statistics
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import app
+
+## UI interactions (component property changed by the user)
+INTERACTIONS = {
+    'page load': None,
+    'open plot menu': 'menu_button.n_clicks',
+    'select menu tab': 'user_data_layers_header.n_clicks_timestamp',
+    'new plot': 'new_plot_button.n_clicks',
+}
+
+## Property changed when plots are added or removed (the list of plots is sent
+## again, so the callbacks with outputs in a plot are called for every plot;
+## those of the existing plots return no update, see check_new_plot.py)
+NEW_COMPONENTS = 'charts.children'
+
+def prop_key(comp_id, prop):
+    ''' Returns "id.prop", or "type.prop" for a pattern-matching id
+    '''
+    if comp_id.startswith('{'):
+        comp_id = json.loads(comp_id)['type']
+    return comp_id + '.' + prop
+
+def split_output(output):
+    ''' Returns the list of "id.prop" outputs of a callback
+    '''
+    if output.startswith('..'):
+        outputs = output.strip('.').split('...')
+    else:
+        outputs = [output]
+    return [prop_key(*x.rsplit('.', 1)) for x in outputs]
+
+def get_callbacks(client):
+    deps = client.get('/_dash-dependencies').json
+    callbacks = []
+    for d in deps:
+        callbacks.append({
+            'output': d['output'],
+            'outputs': split_output(d['output']),
+            'inputs': [prop_key(x['id'], x['property']) for x in d['inputs']],
+            'per_plot': 'MATCH' in d['output'],
+            'clientside': d.get('clientside_function') is not None,
+        })
+    return callbacks
+
+def count_triggered(callbacks, changed):
+    ''' Number of (server, clientside) callbacks triggered by a property change
+        (changed=None: all callbacks, as on page load)
+    '''
+    if changed is None:
+        fired = callbacks
+    else:
+        fired, props = [], [changed]
+        while props:
+            prop = props.pop()
+            for cb in callbacks:
+                new_plot = prop == NEW_COMPONENTS and cb['per_plot']
+                if (prop in cb['inputs'] or new_plot) and cb not in fired:
+                    fired.append(cb)
+                    props.extend(cb['outputs'])
+    num_client = sum(cb['clientside'] for cb in fired)
+    return len(fired) - num_client, num_client
+
+def time_trivial_callback(client, callbacks, repeat=200):
+    ''' Median time of the callback updating the dataset list of a plot
+    '''
+    output = [cb['output'] for cb in callbacks if cb['outputs'][0] == 'dropdown_plot_userdata.options'][0]
+    plot_id = app.plot_id('dropdown_plot_userdata', 1)
+    body = {
+        'output': output,
+        'outputs': [{'id': plot_id, 'property': 'options'}, {'id': plot_id, 'property': 'value'}],
+        'changedPropIds': ['store_data_user.data'],
+        'inputs': [{'id': 'store_data_user', 'property': 'data', 'value': app.dsets_user}],
+        'state': [{'id': plot_id, 'property': 'value', 'value': None}],
+    }
+    t_all = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        client.post('/_dash-update-component', json=body)
+        t_all.append(time.perf_counter() - t0)
+    return 1000 * statistics.median(t_all)
+
+def main():
+    client = app.app.server.test_client()
+    callbacks = get_callbacks(client)
+    num_client = sum(cb['clientside'] for cb in callbacks)
+    print(f"callbacks: {len(callbacks)} ({len(callbacks) - num_client} server, {num_client} clientside)")
+    print(f"{'interaction':<18} {'server requests':>16} {'clientside':>11}")
+    for name, changed in INTERACTIONS.items():
+        n_server, n_client = count_triggered(callbacks, changed)
+        print(f"{name:<18} {n_server:>16} {n_client:>11}")
+    print(f"layout: {len(client.get('/_dash-layout').data)} bytes")
+    print(f"median server time of a trivial callback: {time_trivial_callback(client, callbacks):.2f} ms")
+
+if __name__ == "__main__":
+    sys.exit(main())
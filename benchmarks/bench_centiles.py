@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+''' Benchmark of centile scoring of user subjects against a reference
+
+    python benchmarks/bench_centiles.py [--subjects 100000] [--rois 150]
+
+    The reference table is built from the ROIs of a reference centile file
+    (repeated under new names up to --rois, a third of them on a shifted age
+    grid), and subjects are drawn around the median curves. Reports the
+    scoring time, and checks that values on a centile curve get that centile.
+'''
+import sys
+import time
+import pathlib
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utils_data import load_ref_table, get_centile_index
+from utils_stats import score_centiles, centile_columns
+
+REF_FILE = pathlib.Path(__file__).resolve().parent.parent.joinpath(
+    "data", "reference_data", "CENTILES", "ISTAGING_Centiles_SelROIS_Init+Norm.csv")
+
+def synthetic_ref(num_rois):
+    ''' Reference table with num_rois ROIs (copies of the ROIs of REF_FILE)
+    '''
+    ref = load_ref_table(REF_FILE)
+    rois = list(ref['ROI'].unique())
+    parts = []
+    for i in range(num_rois):
+        d = ref[ref['ROI'] == rois[i % len(rois)]].copy()
+        d['ROI'] = f'R{i}'
+        if i % 3 == 0:
+            d['Age'] = d['Age'] + 0.5
+        parts.append(d)
+    return pd.concat(parts, ignore_index=True)
+
+def synthetic_user(ref, num_subjects, seed=0):
+    ''' User dataset with values around the median curves of the reference
+    '''
+    rng = np.random.RandomState(seed)
+    med = ref.groupby('ROI')['centile_50'].mean()
+    cols = {'Age': rng.uniform(20, 95, num_subjects)}
+    for roi in med.index:
+        cols[roi] = med[roi] * rng.normal(1, 0.1, num_subjects)
+    return pd.DataFrame(cols)
+
+def check_curves(ref):
+    ''' Max error of the centile of values taken on the reference curves
+    '''
+    cols, levels = centile_columns(ref)
+    band = get_centile_index(ref)['R1']
+    i = len(band['Age']) // 2
+    df = pd.DataFrame({'Age': np.repeat(band['Age'][i], len(cols)),
+                       'R1': [band[c][i] for c in cols]})
+    centiles, zscores = score_centiles(df, ref)
+    return np.abs(centiles['R1'].to_numpy() - levels).max()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark centile scoring")
+    parser.add_argument("--subjects", type=int, default=100000)
+    parser.add_argument("--rois", type=int, default=150)
+    args = parser.parse_args(argv)
+
+    ref = synthetic_ref(args.rois)
+    df = synthetic_user(ref, args.subjects)
+    get_centile_index(ref)
+
+    t0 = time.perf_counter()
+    centiles, zscores = score_centiles(df, ref)
+    t1 = time.perf_counter()
+    print(f"{args.subjects} subjects x {args.rois} rois: {t1 - t0:.2f} s")
+    print(f"median centile: {np.nanmedian(centiles.to_numpy()):.1f}")
+    print(f"max error on the reference curves: {check_curves(ref):.2e}")
+
+if __name__ == "__main__":
+    sys.exit(main())
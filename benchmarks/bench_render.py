@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+''' Benchmark of scatter render payloads (SVG vs WebGL traces)
+
+    python benchmarks/bench_render.py [--sizes 1000 10000 100000 1000000] [--html out.html]
+
+    Reports, for each dataset size and render mode, the time to build the
+    figure on the server, the time to serialize it and the payload size.
+    With --html, also writes a self-contained page that times the client
+    draw (Plotly.newPlot) of the same traces in the browser.
+'''
+import sys
+import json
+import time
+import pathlib
+import argparse
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+from plotly import tools
+from plotly.offline import get_plotlyjs
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utils_trace import dots_trace
+
+def synthetic_dset(n, seed=0):
+    ''' Synthetic user dataset with n subjects
+    '''
+    rng = np.random.RandomState(seed)
+    age = rng.uniform(20, 95, n)
+    return pd.DataFrame({'Age': age, 'MUSE_GM': 7e5 - 2e3 * age + rng.normal(0, 5e4, n)})
+
+def bench_payload(n, gl):
+    df = synthetic_dset(n)
+    t0 = time.perf_counter()
+    fig = tools.make_subplots(rows=1, cols=1, print_grid=False)
+    fig.append_trace(dots_trace(df, 'Age', 'MUSE_GM', gl=gl), 1, 1)
+    t1 = time.perf_counter()
+    payload = json.dumps(fig, cls=PlotlyJSONEncoder)
+    t2 = time.perf_counter()
+    return {
+        'n': n, 'mode': 'webgl' if gl else 'svg',
+        'build_ms': 1000 * (t1 - t0), 'serialize_ms': 1000 * (t2 - t1),
+        'payload_mb': len(payload) / 2**20,
+    }
+
+HTML_TEMPLATE = """<html><head><meta charset="utf-8"><script>{plotlyjs}</script></head>
+<body><div id="plot" style="width:800px;height:600px"></div><pre id="out"></pre>
+<script>
+var sizes = {sizes};
+var out = document.getElementById('out');
+function run(i, j) {{
+    if (i >= sizes.length) {{ out.textContent += 'done\\n'; return; }}
+    var n = sizes[i], type = ['scatter', 'scattergl'][j];
+    var x = new Float64Array(n), y = new Float64Array(n);
+    for (var k = 0; k < n; k++) {{ x[k] = 20 + 75 * Math.random(); y[k] = 7e5 - 2e3 * x[k] + 5e4 * (Math.random() - 0.5); }}
+    Plotly.purge('plot');
+    var t0 = performance.now();
+    Plotly.newPlot('plot', [{{x: x, y: y, type: type, mode: 'markers'}}]).then(function() {{
+        requestAnimationFrame(function() {{
+            out.textContent += n + ' ' + type + ' ' + (performance.now() - t0).toFixed(1) + ' ms\\n';
+            setTimeout(function() {{ j == 0 ? run(i, 1) : run(i + 1, 0); }}, 100);
+        }});
+    }});
+}}
+run(0, 0);
+</script></body></html>
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scatter render payloads")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--html", help="write a page timing the client draw to this file")
+    args = parser.parse_args(argv)
+
+    print(f"{'n':>9} {'mode':>6} {'build ms':>9} {'serialize ms':>13} {'payload MB':>11}")
+    for n in args.sizes:
+        for gl in (False, True):
+            r = bench_payload(n, gl)
+            print(f"{r['n']:>9} {r['mode']:>6} {r['build_ms']:>9.1f} {r['serialize_ms']:>13.1f} {r['payload_mb']:>11.2f}")
+
+    if args.html:
+        with open(args.html, 'w') as f:
+            f.write(HTML_TEMPLATE.format(plotlyjs=get_plotlyjs(), sizes=json.dumps(args.sizes)))
+        print(f"Open {args.html} in a browser to time the client draw")
+
+if __name__ == "__main__":
+    sys.exit(main())
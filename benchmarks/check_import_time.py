@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+''' Startup time check of the app (time to import the app module)
+
+    python benchmarks/check_import_time.py                 # exit code 1 if over budget
+    python benchmarks/check_import_time.py --budget 1.5 --top 20
+
+    Imports the app in fresh interpreters with python -X importtime (best of
+    --repeat runs), prints the modules with the largest cumulative import
+    time, and fails if the import takes more than --budget seconds
+    (NICHART_IMPORT_BUDGET) or if a module that must only be loaded on first
+    use (FORBIDDEN) is imported at startup.
+'''
+import os
+import sys
+import pathlib
+import argparse
+import subprocess
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+IMPORT_BUDGET = float(os.environ.get("NICHART_IMPORT_BUDGET", 2.))
+FORBIDDEN = ('sklearn', 'statsmodels', 'scipy')
+
+def import_times(module='app'):
+    ''' (module name, self us, cumulative us, depth) of the imports of a module
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    out = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        t_self, t_cum, name = line[len('import time:'):].split('|')
+        out.append((name.strip(), int(t_self), int(t_cum), (len(name) - len(name.lstrip())) // 2))
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the import time of the app")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="max import time (s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list")
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for i in range(args.repeat)]
+    best = min(runs, key=lambda x: x[-1][2])
+    total = best[-1][2] / 1e6
+
+    ## Slowest modules, indented by depth in the import tree
+    print(f"{'cumulative (s)':>15} {'self (s)':>10}  module")
+    for name, t_self, t_cum, depth in sorted(best, key=lambda x: -x[2])[:args.top]:
+        print(f"{t_cum / 1e6:15.3f} {t_self / 1e6:10.3f}  {'  ' * depth}{name}")
+
+    failed = False
+    loaded = {x[0] for x in best}
+    for name in FORBIDDEN:
+        if name in loaded:
+            print(f"FAIL {name} is imported at startup (should be imported on first use)")
+            failed = True
+    if total > args.budget:
+        print(f"FAIL import {args.module}: {total:.2f} s (budget {args.budget:.2f} s)")
+        failed = True
+    else:
+        print(f"import {args.module}: {total:.2f} s (budget {args.budget:.2f} s)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+''' Check that adding a plot leaves the existing plots alone
+
+    python benchmarks/check_new_plot.py                    # exit code 1 on failure
+
+    Adding or removing a plot sends the list of plots again, and the browser
+    runs the callbacks of all plots as for new components. This replays with
+    the Flask test client the server callbacks of plot 1 (with the state it
+    has after the user changed its selection), as the browser calls them when
+    plot 2 is added, and checks that they keep the selection of plot 1 and do
+    not send its figure or data layers again, while plot 2 gets a figure.
+'''
+import sys
+import json
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import app
+
+LAYER = 'linreg_trace'
+
+def prop_id(comp_id, prop):
+    if isinstance(comp_id, dict):
+        comp_id = json.dumps(comp_id, sort_keys=True, separators=(',', ':'))
+    return comp_id + '.' + prop
+
+class Replay:
+    ''' Calls server callbacks as the browser does, keeping the properties of
+        the components up to date with the responses
+    '''
+    def __init__(self, client):
+        self.client = client
+        self.deps = client.get('/_dash-dependencies').json
+        self.props = {}
+
+    def set(self, comp_id, prop, value):
+        self.props[prop_id(comp_id, prop)] = value
+
+    def get(self, comp_id, prop):
+        return self.props.get(prop_id(comp_id, prop))
+
+    def call(self, first_output, index, changed=()):
+        ''' Calls the callback of an output (for plot index), returns the
+            HTTP status and the updated properties
+        '''
+        dep = [d for d in self.deps if f'"type":"{first_output}"' in d['output'].split('...')[0]
+               or d['output'].strip('.').startswith(first_output + '.')][0]
+        def resolve(x):
+            comp_id = x['id']
+            if comp_id.startswith('{'):
+                comp_id = dict(json.loads(comp_id), index=index)
+            return {'id': comp_id, 'property': x['property'], 'value': self.get(comp_id, x['property'])}
+        outputs = [resolve(x) for x in dep['outputs']] if 'outputs' in dep else None
+        if outputs is None:
+            outputs = []
+            for x in dep['output'].strip('.').split('...'):
+                comp_id, prop = x.rsplit('.', 1)
+                outputs.append(resolve({'id': comp_id, 'property': prop}))
+        for x in outputs:
+            x.pop('value')
+        body = {
+            'output': dep['output'],
+            'outputs': outputs if len(outputs) > 1 else outputs[0],
+            'changedPropIds': [prop_id(*x) for x in changed],
+            'inputs': [resolve(x) for x in dep['inputs']],
+            'state': [resolve(x) for x in dep['state']],
+        }
+        r = self.client.post('/_dash-update-component', json=body)
+        updated = {}
+        if r.status_code == 200:
+            for comp_id, props in r.json['response'].items():
+                for prop, value in props.items():
+                    self.props[prop_id(comp_id, prop)] = value
+                    updated[prop_id(comp_id, prop)] = value
+        return r.status_code, updated
+
+def init_plot(replay, index):
+    ''' Properties of a new plot (as in the plot template)
+    '''
+    pid = lambda x: app.plot_id(x, index)
+    replay.set(pid('plot_type'), 'value', 'dots_trace')
+    replay.set(pid('dropdown_xvar'), 'value', 'Age')
+    replay.set(pid('dropdown_yvar'), 'value', 'MUSE_GM')
+    replay.set(pid('render_mode'), 'value', 'auto')
+    replay.set(pid('bar_stat'), 'value', 'mean')
+    replay.set(pid('bin_width'), 'value', app.BIN_WIDTH)
+    replay.set(pid('user_data_layers'), 'value', [LAYER])
+    replay.set(pid('ref_data_layers'), 'value', [])
+
+def run_plot_callbacks(replay, index):
+    ''' Server callbacks of a plot, in the order the browser calls them on
+        page load or when the list of plots is sent again
+    '''
+    out = {}
+    for name in ('dropdown_plot_refdata', 'dropdown_plot_userdata', 'base_fig', LAYER + '_traces'):
+        out[name] = replay.call(name, index)
+    return out
+
+def main():
+    replay = Replay(app.app.server.test_client())
+    replay.set('store_data_ref', 'data', app.dsets_ref)
+    replay.set('store_data_user', 'data', app.dsets_user)
+
+    ## Plot 1: page load, then the user selects another dataset
+    init_plot(replay, 1)
+    run_plot_callbacks(replay, 1)
+    user_dsets = list(app.dsets_user)
+    selected = user_dsets[-1]
+    replay.set(app.plot_id('dropdown_plot_userdata', 1), 'value', selected)
+    changed = [(app.plot_id('dropdown_plot_userdata', 1), 'value')]
+    replay.call('base_fig', 1, changed)
+    replay.call(LAYER + '_traces', 1, changed)
+    fig = replay.get(app.plot_id('base_fig', 1), 'data')
+
+    ## Plot 2 is added: callbacks of both plots run again
+    init_plot(replay, 2)
+    out1 = run_plot_callbacks(replay, 1)
+    out2 = run_plot_callbacks(replay, 2)
+
+    failed = []
+    if replay.get(app.plot_id('dropdown_plot_userdata', 1), 'value') != selected:
+        failed.append('the dataset selected in plot 1 was reset')
+    if replay.get(app.plot_id('base_fig', 1), 'data') != fig:
+        failed.append('the figure of plot 1 changed')
+    for name in ('base_fig', LAYER + '_traces'):
+        if out1[name][0] != 204:
+            failed.append(f'plot 1 sent {name} again (status {out1[name][0]})')
+    if replay.get(app.plot_id('dropdown_plot_userdata', 2), 'value') != user_dsets[0]:
+        failed.append('plot 2 has no dataset selected')
+    if out2['base_fig'][0] != 200:
+        failed.append('plot 2 got no figure')
+
+    for name, (status, updated) in out1.items():
+        print(f"plot 1 {name:<24} status {status}, updated: {sorted(x.rsplit('.', 1)[1] for x in updated)}")
+    for x in failed:
+        print('FAIL ' + x)
+    if not failed:
+        print('adding a plot leaves plot 1 unchanged')
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+''' Memory of the gunicorn workers of the app, with and without --preload
+
+    python benchmarks/measure_workers.py                  # 4 workers, both modes
+    python benchmarks/measure_workers.py --workers 16 --mode preload
+
+    Starts gunicorn (as in the Procfile) on a local port, sends a few
+    requests once it is up, and reads /proc/<pid>/smaps_rollup of each worker
+    (Linux only). RSS counts shared pages in every process; PSS splits them
+    between the processes that share them, and USS (private) is what each
+    extra worker costs. The total is the sum of the PSS of the master and
+    the workers.
+'''
+import os
+import sys
+import time
+import signal
+import pathlib
+import argparse
+import subprocess
+import urllib.request
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+def smaps(pid):
+    ''' Memory fields (in MB) of a process from /proc/<pid>/smaps_rollup
+    '''
+    out = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(':') in FIELDS:
+                out[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    out['Uss'] = out.pop('Private_Clean', 0) + out.pop('Private_Dirty', 0)
+    return out
+
+def children(pid):
+    out = []
+    for d in pathlib.Path('/proc').iterdir():
+        if not d.name.isdigit():
+            continue
+        try:
+            ppid = int(d.joinpath('stat').read_text().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            out.append(int(d.name))
+    return sorted(out)
+
+def wait_ready(url, num_workers, proc, timeout):
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited')
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            if len(children(proc.pid)) >= num_workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('gunicorn did not start')
+
+def measure(num_workers, preload, port, num_requests, timeout):
+    cmd = ['gunicorn', 'app:server', '--workers', str(num_workers), '--bind', f'127.0.0.1:{port}']
+    if preload:
+        cmd.append('--preload')
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f'http://127.0.0.1:{port}'
+        wait_ready(url + '/', num_workers, proc, timeout)
+        ## Requests are spread over the workers (initial layout and dependencies)
+        for i in range(num_requests):
+            for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+                urllib.request.urlopen(url + path, timeout=30).read()
+        time.sleep(1)
+        workers = [smaps(pid) for pid in children(proc.pid)]
+        master = smaps(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+    return master, workers
+
+def mean(workers, field):
+    return sum(x[field] for x in workers) / len(workers)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory of the gunicorn workers")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=['both', 'preload', 'no-preload'], default='both')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=20, help="number of requests of each type")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args(argv)
+
+    modes = {'both': [False, True], 'preload': [True], 'no-preload': [False]}[args.mode]
+    print(f"{'mode':<11} {'RSS/worker':>11} {'PSS/worker':>11} {'USS/worker':>11} {'total PSS':>10}  (MB)")
+    for preload in modes:
+        master, workers = measure(args.workers, preload, args.port, args.requests, args.timeout)
+        total = master['Pss'] + sum(x['Pss'] for x in workers)
+        print(f"{'preload' if preload else 'no-preload':<11} {mean(workers, 'Rss'):11.1f} {mean(workers, 'Pss'):11.1f}"
+              f" {mean(workers, 'Uss'):11.1f} {total:10.1f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
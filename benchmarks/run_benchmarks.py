@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+''' Benchmark suite for the plotting and ingestion hot paths
+
+    python benchmarks/run_benchmarks.py --out baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json     # exit code 1 on regression
+    python benchmarks/run_benchmarks.py --rows 1000 100000 --rois 7 --bench create_plot lowess_trace
+
+    Times create_plot, the trace functions of utils_trace, parse_contents and
+    the store -> DataFrame round trip on synthetic datasets (rows x ROIs),
+    and records the peak memory of each benchmark (tracemalloc, in a separate
+    run). Cases with more than --max-cells values are skipped.
+
+    Timings: "cold" runs start with empty derived data / figure caches (as
+    for a new dataset), "warm" runs reuse them (as for a repeated request).
+    Results are written as JSON. With --compare, results are compared with a
+    saved baseline: a benchmark regresses if its time or peak memory grows by
+    more than --threshold (ratio), ignoring times below --min-time.
+'''
+import os
+import sys
+import gc
+import json
+import time
+import base64
+import pathlib
+import platform
+import argparse
+import statistics
+import tempfile
+import tracemalloc
+
+## Datasets registered by the benchmarks are written to a temporary cache dir
+os.environ.setdefault("NICHART_CACHE_DIR", tempfile.mkdtemp(prefix="nichart-bench-"))
+
+import numpy as np
+import pandas as pd
+from plotly import tools
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import app
+import utils_data
+import utils_stats
+import utils_trace
+from utils_data import register_dataset, get_dataset, load_ref_table
+
+ROWS = [100, 1000, 10000, 100000, 1000000]
+ROIS = [7, 150, 500]
+MAX_CELLS = 2 * 10**7
+CENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+####### Synthetic data ######
+
+def synthetic_user(num_rows, num_rois, seed=0):
+    ''' User dataset with an Age column and num_rois ROI columns
+    '''
+    rng = np.random.RandomState(seed)
+    age = rng.uniform(20, 95, num_rows)
+    cols = {'Age': age}
+    for i in range(num_rois):
+        cols[f'MUSE_{i}'] = 1e5 * (1 + i % 10) * (1.2 - 0.004 * age) * rng.normal(1, 0.1, num_rows)
+    return pd.DataFrame(cols, index=pd.Index([f'Subj{i}' for i in range(num_rows)], name='ID'))
+
+def synthetic_ref(num_rois, tmp_dir):
+    ''' Reference centile table (ROI, Age, centile_5 ... centile_95) for the
+        ROIs of synthetic_user, loaded through the reference cache
+    '''
+    age = np.arange(20., 96.)
+    z = utils_stats._norm_ppf(np.asarray(CENTILES, dtype=np.float64) / 100)
+    parts = []
+    for i in range(num_rois):
+        mean = 1e5 * (1 + i % 10) * (1.2 - 0.004 * age)
+        part = pd.DataFrame(mean[:, None] * (1 + 0.1 * z[None, :]), columns=[f'centile_{p}' for p in CENTILES])
+        part.insert(0, 'Age', age)
+        part.insert(0, 'ROI', f'MUSE_{i}')
+        parts.append(part)
+    csv_file = pathlib.Path(tmp_dir).joinpath(f'ref_{num_rois}.csv')
+    pd.concat(parts, ignore_index=True).to_csv(csv_file, index=False)
+    return load_ref_table(csv_file)
+
+def clear_caches():
+    ''' Empties the derived data and figure caches
+    '''
+    utils_data._DERIVED.clear()
+    app.fig_cache.clear()
+    app.layer_cache.clear()
+
+####### Benchmarks ######
+## Each benchmark takes (user df, ref df) and returns (setup, run): setup()
+## is called (untimed) before each timed run, and returns the arguments of run
+## (setup=None: run takes no arguments).
+
+def new_fig():
+    return (tools.make_subplots(rows=1, cols=1, print_grid=False),)
+
+def bench_create_plot(df, ref):
+    return None, lambda: app.create_plot(ref, df, 'dots_trace', ['percentile_trace'],
+                                         ['linreg_trace', 'lowess_trace'], 'Age', 'MUSE_0')
+
+def bench_percentile_trace(df, ref):
+    return new_fig, lambda fig: utils_trace.percentile_trace(ref, 'Age', 'MUSE_0', fig)
+
+def bench_dots_trace(df, ref):
+    return None, lambda: utils_trace.dots_trace(df, 'Age', 'MUSE_0')
+
+def bench_bar_trace(df, ref):
+    return None, lambda: utils_trace.bar_trace(df, 'Age', 'MUSE_0', stat='median')
+
+def bench_box_trace(df, ref):
+    return None, lambda: utils_trace.box_trace(df, 'Age', 'MUSE_0')
+
+def bench_violin_trace(df, ref):
+    return None, lambda: utils_trace.violin_trace(df, 'Age', 'MUSE_0')
+
+def bench_linreg_trace(df, ref):
+    return new_fig, lambda fig: utils_trace.linreg_trace(df, 'Age', 'MUSE_0', fig)
+
+def bench_lowess_trace(df, ref):
+    return new_fig, lambda fig: utils_trace.lowess_trace(df, 'Age', 'MUSE_0', fig)
+
+def bench_centile_trace(df, ref):
+    return new_fig, lambda fig: utils_trace.centile_trace(df, 'Age', 'MUSE_0', fig, dset_ref=ref)
+
+def bench_density_trace(df, ref):
+    return new_fig, lambda fig: utils_trace.density_trace(df, 'Age', 'MUSE_0', fig, bins=(112, 56))
+
+def bench_parse_contents(df, ref):
+    contents = 'data:text/csv;base64,' + base64.b64encode(df.to_csv().encode('utf-8')).decode('ascii')
+    return None, lambda: app.parse_contents(contents, 'bench.csv')
+
+def bench_store_roundtrip(df, ref):
+    ''' Dataset -> handle in a dcc.Store (JSON) -> dataset, as in a callback
+    '''
+    handle = json.loads(json.dumps(register_dataset(df, 'bench')))
+    return None, lambda: get_dataset(json.loads(json.dumps(handle)))
+
+def bench_store_roundtrip_disk(df, ref):
+    ''' Same, for a dataset registered by another worker (read from the cache dir)
+    '''
+    handle = json.loads(json.dumps(register_dataset(df, 'bench')))
+    def setup():
+        utils_data._DATASETS.pop(handle['hash'], None)
+        return ()
+    return setup, lambda: get_dataset(json.loads(json.dumps(handle)))
+
+BENCHMARKS = {
+    'create_plot': bench_create_plot,
+    'percentile_trace': bench_percentile_trace,
+    'dots_trace': bench_dots_trace,
+    'bar_trace': bench_bar_trace,
+    'box_trace': bench_box_trace,
+    'violin_trace': bench_violin_trace,
+    'linreg_trace': bench_linreg_trace,
+    'lowess_trace': bench_lowess_trace,
+    'centile_trace': bench_centile_trace,
+    'density_trace': bench_density_trace,
+    'parse_contents': bench_parse_contents,
+    'store_roundtrip': bench_store_roundtrip,
+    'store_roundtrip_disk': bench_store_roundtrip_disk,
+}
+
+def time_runs(setup, run, repeat, cold):
+    t_all = []
+    for i in range(repeat):
+        if cold:
+            clear_caches()
+        args = setup() if setup is not None else ()
+        t0 = time.perf_counter()
+        run(*args)
+        t_all.append(time.perf_counter() - t0)
+    return t_all
+
+def peak_memory(setup, run):
+    ''' Peak memory (in MB) allocated by a cold run
+    '''
+    clear_caches()
+    args = setup() if setup is not None else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(*args)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def run_suite(rows, rois, benches, repeat, max_cells, tmp_dir):
+    results = {}
+    for num_rois in rois:
+        ref = synthetic_ref(num_rois, tmp_dir)
+        for num_rows in rows:
+            if num_rows * num_rois > max_cells:
+                print(f"skip rows={num_rows} rois={num_rois} (more than {max_cells} values)")
+                continue
+            df = synthetic_user(num_rows, num_rois)
+            for name in benches:
+                setup, run = BENCHMARKS[name](df, ref)
+                ## Fewer repeats for long runs
+                t_cold = time_runs(setup, run, 1, True)
+                num = repeat if t_cold[0] < 1 else 1
+                t_cold += time_runs(setup, run, num - 1, True)
+                t_warm = time_runs(setup, run, num, False)
+                res = {
+                    'rows': num_rows, 'rois': num_rois,
+                    'cold_s': statistics.median(t_cold), 'warm_s': statistics.median(t_warm),
+                    'peak_mb': peak_memory(setup, run),
+                }
+                key = f"{name}|rows={num_rows}|rois={num_rois}"
+                results[key] = res
+                print(f"{key:<48} cold {1000 * res['cold_s']:10.2f} ms  warm {1000 * res['warm_s']:10.2f} ms"
+                      f"  peak {res['peak_mb']:9.1f} MB")
+            del df
+            clear_caches()
+            gc.collect()
+    return results
+
+def compare(results, baseline, threshold, min_time):
+    ''' Returns the list of regressions of results relative to baseline
+    '''
+    regressions = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ('cold_s', 'warm_s', 'peak_mb'):
+            old, new = base[metric], res[metric]
+            if metric.endswith('_s') and max(old, new) < min_time:
+                continue
+            ratio = new / old if old > 0 else float('inf')
+            if ratio > threshold:
+                regressions.append((key, metric, old, new, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the plotting and ingestion hot paths")
+    parser.add_argument("--rows", type=int, nargs="+", default=ROWS)
+    parser.add_argument("--rois", type=int, nargs="+", default=ROIS)
+    parser.add_argument("--bench", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-cells", type=int, default=MAX_CELLS, help="max rows x rois of a case")
+    parser.add_argument("--out", help="output json file")
+    parser.add_argument("--compare", help="baseline json file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="max ratio to the baseline")
+    parser.add_argument("--min-time", type=float, default=0.02, help="times below this (s) are not compared")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_suite(args.rows, args.rois, args.bench, args.repeat, args.max_cells, tmp_dir)
+    out = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(out, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        for key, metric, old, new, ratio in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g} (x{ratio:.2f})")
+        if regressions:
+            return 1
+        print(f"no regressions (threshold x{args.threshold})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
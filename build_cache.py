@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+''' Builds the binary cache for reference centile tables
+
+    python build_cache.py            # build/refresh the cache for all centile files
+    python build_cache.py --bench    # also compare load times against the csv path
+'''
+import sys
+import time
+import pathlib
+import argparse
+import pandas as pd
+from utils_data import CACHE_PATH, get_ref_cache, load_ref_table
+
+PATH = pathlib.Path(__file__).parent
+DATA_PATH2 = PATH.joinpath("data", "reference_data", 'CENTILES').resolve()
+
+def time_min(fn, repeat):
+    ''' Minimum run time of a function (in seconds)
+    '''
+    t_all = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        t_all.append(time.perf_counter() - t0)
+    return min(t_all)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the reference centile cache")
+    parser.add_argument("--bench", action="store_true", help="compare load times against the csv path")
+    parser.add_argument("--repeat", type=int, default=5, help="number of repeats for --bench")
+    args = parser.parse_args(argv)
+
+    csv_files = sorted(DATA_PATH2.glob("*.csv"))
+    for csv_file in csv_files:
+        meta = get_ref_cache(csv_file)
+        print(f"{csv_file.name}: {meta['nrows']} rows -> {CACHE_PATH.joinpath('reference', csv_file.stem)}")
+
+    if args.bench:
+        t_csv = time_min(lambda: [pd.read_csv(x).to_dict('records') for x in csv_files], args.repeat)
+        t_df = time_min(lambda: [pd.read_csv(x) for x in csv_files], args.repeat)
+        t_cache = time_min(lambda: [load_ref_table(x) for x in csv_files], args.repeat)
+        print(f"csv + to_dict('records') : {1000 * t_csv:8.2f} ms")
+        print(f"csv -> DataFrame         : {1000 * t_df:8.2f} ms")
+        print(f"cache (mmap) -> DataFrame: {1000 * t_cache:8.2f} ms")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+''' Fits reference centile tables from raw cohort data
+
+    python fit_centiles.py data/csv_data/unnorm_Age_MLP.csv out.csv
+    python fit_centiles.py cohort.csv out.csv --rois MUSE_GM MUSE_WM --workers 8
+
+    Writes a table in the format of the reference data (ROI, Age, centile_5
+    ... centile_95), with curves fitted by fit_centile_curves (utils_stats).
+    ROIs are fitted in parallel in a process pool. A sidecar file
+    (out.csv.fit.json) keeps a fingerprint of the input data and fit
+    parameters of each ROI: on later runs only ROIs whose fingerprint changed
+    are refitted, the others are copied from the existing output.
+'''
+import os
+import sys
+import json
+import time
+import hashlib
+import pathlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from utils_stats import CENTILE_LEVELS, fit_centile_curves
+
+def roi_fingerprint(x, y, params):
+    ''' Fingerprint of the input data and fit parameters of a ROI
+    '''
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    h.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+def _fit_roi(args):
+    roi, x, y, ages, params = args
+    return roi, fit_centile_curves(x, y, ages, levels=params['levels'],
+                                   bandwidth=params['bandwidth'], min_points=params['min_points'])
+
+def read_sidecar(sidecar_file, out_file):
+    ''' Returns the ROI fingerprints of a previous run (if its output is still there)
+    '''
+    if not (sidecar_file.exists() and out_file.exists()):
+        return {}
+    try:
+        with open(sidecar_file) as f:
+            return json.load(f).get('rois', {})
+    except ValueError:
+        return {}
+
+def write_atomic(out_file, write_fn):
+    tmp_file = out_file.with_name(f'.{out_file.name}.{os.getpid()}.tmp')
+    write_fn(tmp_file)
+    os.replace(tmp_file, out_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit reference centile curves from a cohort csv file")
+    parser.add_argument("in_csv", help="cohort data (one row per subject)")
+    parser.add_argument("out_csv", help="output centile table")
+    parser.add_argument("--xvar", default="Age", help="column of the x variable")
+    parser.add_argument("--rois", nargs="+", help="ROI columns (default: all numeric columns)")
+    parser.add_argument("--age-step", type=float, default=1., help="step of the age grid")
+    parser.add_argument("--bandwidth", type=float, help="minimum kernel half width")
+    parser.add_argument("--min-points", type=int, default=200, help="minimum number of subjects in the kernel")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--force", action="store_true", help="refit all ROIs")
+    args = parser.parse_args(argv)
+
+    in_file = pathlib.Path(args.in_csv)
+    out_file = pathlib.Path(args.out_csv)
+    sidecar_file = out_file.with_name(out_file.name + '.fit.json')
+
+    df = pd.read_csv(in_file, index_col=0, float_precision='round_trip')
+    rois = args.rois
+    if rois is None:
+        rois = [c for c in df.columns if c != args.xvar and pd.api.types.is_numeric_dtype(df[c])]
+    x = df[args.xvar].to_numpy(dtype=np.float64)
+    x_fin = x[np.isfinite(x)]
+    ages = np.arange(np.floor(x_fin.min()), np.ceil(x_fin.max()) + args.age_step / 2, args.age_step)
+    params = {
+        'levels': list(CENTILE_LEVELS), 'bandwidth': args.bandwidth, 'min_points': args.min_points,
+        'xvar': args.xvar, 'ages': ages.tolist(),
+    }
+
+    ## ROIs to refit
+    prev = {} if args.force else read_sidecar(sidecar_file, out_file)
+    fingerprints = {roi: roi_fingerprint(x, df[roi], params) for roi in rois}
+    todo = [roi for roi in rois if prev.get(roi) != fingerprints[roi]]
+    print(f"{len(rois)} rois, {len(todo)} to fit ({len(df)} subjects, {len(ages)} ages)")
+
+    t0 = time.perf_counter()
+    curves = {}
+    if todo:
+        tasks = [(roi, x, df[roi].to_numpy(dtype=np.float64), ages, params) for roi in todo]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for roi, curve in pool.map(_fit_roi, tasks):
+                curves[roi] = curve
+    print(f"fitted in {time.perf_counter() - t0:.2f} s")
+
+    ## Output table (unchanged ROIs are copied from the previous output)
+    cols = [f'centile_{p}' for p in CENTILE_LEVELS]
+    old = pd.read_csv(out_file, float_precision='round_trip') if len(todo) < len(rois) else None
+    parts = []
+    for roi in rois:
+        if roi in curves:
+            part = pd.DataFrame(curves[roi], columns=cols)
+            part.insert(0, 'Age', ages)
+            part.insert(0, 'ROI', roi)
+        else:
+            part = old[old['ROI'] == roi]
+        parts.append(part)
+    table = pd.concat(parts, ignore_index=True)[['ROI', 'Age'] + cols]
+
+    write_atomic(out_file, lambda f: table.to_csv(f, index=False))
+    write_atomic(sidecar_file, lambda f: f.write_text(json.dumps({'rois': fingerprints}, indent=1)))
+    print(f"{out_file}: {len(table)} rows")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,6 @@ import os
 import json
 import base64
 import datetime
-import requests
 import pathlib
 import math
 import pandas as pd
@@ -12,9 +11,7 @@ import flask
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import plotly.plotly as py
 import plotly.graph_objs as go
-from sklearn.linear_model import LinearRegression
 import base64
 from dash.dependencies import Input, Output, State
 from plotly import tools
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+####### LRU cache ######
+
+def approx_size(obj):
+    ''' Approximate memory size (in bytes) of a figure dict or any nested python object
+    '''
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return int(obj.nbytes)
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(approx_size(v) for v in obj)
+    if hasattr(obj, 'to_plotly_json'):
+        return approx_size(obj.to_plotly_json())
+    return sys.getsizeof(obj)
+
+class LRUCache:
+    ''' Bounded least-recently-used cache
+        Entries are evicted when either the number of entries or their total
+        (approximate) size exceeds the limits. Keeps hit/miss/eviction counters.
+    '''
+    def __init__(self, max_entries=256, max_bytes=256 * 2**20, sizeof=approx_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            ## Values larger than the whole cache are not stored
+            if size > self.max_bytes:
+                return value
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while len(self._data) > self.max_entries or self.nbytes > self.max_bytes:
+                self.nbytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, fn):
+        ''' Returns the cached value for key, or computes it with fn() and stores it
+        '''
+        value = self.get(key, self)
+        if value is self:
+            value = self.put(key, fn())
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self.nbytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._data), 'bytes': self.nbytes,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+        }
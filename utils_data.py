@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import hmac
+import json
+import weakref
+import base64
+import binascii
+import pathlib
+import hashlib
+import numpy as np
+import pandas as pd
+from utils_cache import LRUCache
+
+PATH = pathlib.Path(__file__).parent
+CACHE_PATH = pathlib.Path(os.environ.get("NICHART_CACHE_DIR", PATH.joinpath("cache"))).resolve()
+
+####### Dataset registry ######
+## Datasets are kept on the server; dcc.Store components only hold small handles
+## {'id', 'hash', 'nrows', 'columns', 'dtypes', 'derived'} that point into this
+## registry ('derived': columns computed on demand, see resolve_columns).
+## Each registered dataset is also written to the cache dir, so that a handle
+## created by one gunicorn worker can be resolved by the others.
+## Handles come from the browser: keys must be sha1 hex digests (so that they
+## cannot point outside the cache dir), and dataset files are signed with a
+## secret key (NICHART_SECRET_KEY, or a random key kept in the cache dir) that
+## is checked before a file is unpickled.
+## Datasets and derived data are kept in bounded LRU caches (limits can be set 
+## with env variables); evicted datasets are read again from the cache dir, and
+## evicted derived data is computed again.
+
+_DATASETS = LRUCache(
+    max_entries = int(os.environ.get("NICHART_DATASET_CACHE_ENTRIES", 32)),
+    max_bytes = int(os.environ.get("NICHART_DATASET_CACHE_MB", 1024)) * 2**20,
+)
+_DERIVED = LRUCache(
+    max_entries = int(os.environ.get("NICHART_DERIVED_CACHE_ENTRIES", 1024)),
+    max_bytes = int(os.environ.get("NICHART_DERIVED_CACHE_MB", 512)) * 2**20,
+)
+## Registry keys of the dataframes in use (by id, removed with the dataframe)
+_KEYS = {}
+
+def _set_key(df, key):
+    i = id(df)
+    def forget(ref):
+        if _KEYS.get(i, (None,))[0] is ref:
+            del _KEYS[i]
+    _KEYS[i] = (weakref.ref(df, forget), key)
+
+def hash_df(df):
+    ''' Content hash of a dataframe (column names + values)
+    '''
+    h = hashlib.sha1()
+    h.update(str(list(df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+_KEY_RE = re.compile('[0-9a-f]{40}')
+_SECRET = []
+
+def valid_key(key):
+    ''' Checks if a registry key (e.g. from a handle sent by the browser) is a sha1 hex digest
+    '''
+    return isinstance(key, str) and _KEY_RE.fullmatch(key) is not None
+
+def _secret_key():
+    ''' Key used to sign the dataset files (created once, shared by all workers)
+    '''
+    if not _SECRET:
+        secret = os.environ.get("NICHART_SECRET_KEY")
+        if secret:
+            _SECRET.append(secret.encode('utf-8'))
+            return _SECRET[0]
+        key_file = CACHE_PATH.joinpath("secret.key")
+        if not key_file.exists():
+            key_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = key_file.with_suffix(".tmp" + str(os.getpid()))
+            with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(os.urandom(32).hex().encode('ascii'))
+            try:
+                ## Fails if another process created the key first
+                os.link(tmp_file, key_file)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_file)
+        _SECRET.append(key_file.read_bytes())
+    return _SECRET[0]
+
+def _dataset_file(key):
+    if not valid_key(key):
+        raise ValueError('invalid dataset key: ' + repr(key))
+    return CACHE_PATH.joinpath("datasets", key + ".spkl")
+
+def _file_hmac(f):
+    ''' Signature of the rest of an open file (from the current position)
+    '''
+    h = hmac.new(_secret_key(), digestmod=hashlib.sha256)
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        h.update(chunk)
+    return h.digest()
+
+def sign_bytes(data):
+    ''' Returns data prefixed with its signature (32 bytes)
+    '''
+    return _file_hmac(io.BytesIO(data)) + data
+
+def unsign_bytes(blob):
+    ''' Returns the data of a blob written by sign_bytes (None if it is not
+        signed with our key)
+    '''
+    blob = bytes(blob)
+    data = blob[32:]
+    if not hmac.compare_digest(blob[:32], _file_hmac(io.BytesIO(data))):
+        return None
+    return data
+
+def _signed_file(in_file):
+    ''' Checks if a dataset file exists and is signed with our key
+    '''
+    try:
+        with open(in_file, 'rb') as f:
+            sig = f.read(32)
+            return hmac.compare_digest(sig, _file_hmac(f))
+    except OSError:
+        return False
+
+def _save_dataset(df, key):
+    ''' Writes a dataset file: signature of the pickle (32 bytes) + pickle
+        (a file that is not signed with our key, e.g. after the key changed, is replaced)
+    '''
+    out_file = _dataset_file(key)
+    if _signed_file(out_file):
+        return
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = out_file.with_suffix(".tmp" + str(os.getpid()))
+    with open(tmp_file, 'w+b') as f:
+        f.write(bytes(32))
+        df.to_pickle(f)
+        f.seek(32)
+        sig = _file_hmac(f)
+        f.seek(0)
+        f.write(sig)
+    os.replace(tmp_file, out_file)
+
+def _load_dataset(key):
+    ''' Reads a dataset file (None if it is missing or not signed with our key)
+    '''
+    in_file = _dataset_file(key)
+    if not in_file.exists():
+        return None
+    with open(in_file, 'rb') as f:
+        sig = f.read(32)
+        if not hmac.compare_digest(sig, _file_hmac(f)):
+            print('Warning: dataset file with an invalid signature, ignored: ', in_file)
+            return None
+        f.seek(32)
+        df = pd.read_pickle(f)
+    if not isinstance(df, pd.DataFrame):
+        print('Warning: dataset file is not a dataframe, ignored: ', in_file)
+        return None
+    return df
+
+def make_handle(name, key, df, derived=()):
+    ''' Returns the handle stored in the browser for a registered dataset
+    '''
+    return {
+        'id': name,
+        'hash': key,
+        'nrows': len(df),
+        'columns': [str(x) for x in df.columns],
+        'dtypes': [str(x) for x in df.dtypes],
+        'derived': list(derived),
+    }
+
+def register_dataset(df, name, key=None, derived=()):
+    ''' Adds a dataframe to the registry and returns its handle
+        key: content hash of the source data (by default, the hash of the dataframe)
+        derived: names of the columns computed on demand
+    '''
+    if key is None:
+        key = hash_df(df)
+    if not valid_key(key):
+        raise ValueError('invalid dataset key: ' + repr(key))
+    df_reg = _DATASETS.get(key)
+    if df_reg is None:
+        df_reg = df
+        _DATASETS.put(key, df)
+        _set_key(df, key)
+        _save_dataset(df, key)
+    return make_handle(name, key, df_reg, derived)
+
+def get_dataset(handle):
+    ''' Returns the dataframe for a handle (or None if it is unknown)
+    '''
+    if not isinstance(handle, dict) or not valid_key(handle.get('hash')):
+        return None
+    key = handle['hash']
+    df = _DATASETS.get(key)
+    if df is None:
+        df = _load_dataset(key)
+        if df is None:
+            return None
+        _DATASETS.put(key, df)
+        _set_key(df, key)
+    return df
+
+def has_dataset(key):
+    ''' Checks if a dataset is in the registry (in this process, or in the cache dir
+        with a valid signature)
+    '''
+    return valid_key(key) and (key in _DATASETS or _signed_file(_dataset_file(key)))
+
+def dataset_key(df):
+    ''' Returns the registry key of a dataframe (hashing it if it is not registered)
+    '''
+    ref, key = _KEYS.get(id(df), (None, None))
+    if ref is not None and ref() is df:
+        return key
+    return hash_df(df)
+
+def get_derived(df, name, fn):
+    ''' Returns data derived from a dataframe, computing it with fn(df) only once
+        per (dataset, name)
+    '''
+    key = (dataset_key(df), name)
+    return _DERIVED.get_or_create(key, lambda: fn(df))
+
+def has_derived(df, name):
+    ''' Checks if data derived from a dataframe is cached (in this process)
+    '''
+    return (dataset_key(df), name) in _DERIVED
+
+####### ICV normalization ######
+## ROI volumes are normalized by the intracranial volume:
+##   MUSE_nX = MUSE_X / MUSE_ICV * ICV_SCALE
+## for a set of ROIs (ICV_ROIS, set with NICHART_ICV_ROIS as a comma separated
+## list; by default all MUSE volume columns of the dataset). The stage runs
+## when a dataset is loaded or uploaded (ICV_NORM_MODE):
+##   - 'lazy': columns are computed on first use (only the ones used by a
+##     plot, in one vectorized pass) and joined to the columns of the plot
+##   - 'materialize': columns are added to the dataset
+##   - 'off': no normalization
+## Columns already in the dataset are not recomputed.
+
+ICV_COL = 'MUSE_ICV'
+ICV_SCALE = 1.4e6
+ICV_ROIS = tuple(x.strip() for x in os.environ.get("NICHART_ICV_ROIS", "").split(",") if x.strip()) or None
+ICV_NORM_MODE = os.environ.get("NICHART_ICV_NORM", "lazy")
+
+def icv_norm_name(roi):
+    ''' Name of the normalized column of a ROI (MUSE_GM -> MUSE_nGM)
+    '''
+    return roi.replace('MUSE_', 'MUSE_n', 1)
+
+def muse_volumes(df):
+    ''' MUSE volume columns of df (numeric MUSE_* columns, except the ICV and
+        the normalized columns of other columns)
+    '''
+    cols = set(df.columns)
+    return [
+        c for c in df.columns 
+        if isinstance(c, str) and c.startswith('MUSE_') and c != ICV_COL
+        and not (c.startswith('MUSE_n') and 'MUSE_' + c[len('MUSE_n'):] in cols)
+        and pd.api.types.is_numeric_dtype(df[c])
+    ]
+
+def icv_norm_rois(df, rois=None):
+    ''' ROIs of df that can be normalized (and are not normalized yet)
+        rois: ROIs to normalize (default: ICV_ROIS, or all MUSE volumes of df)
+    '''
+    if ICV_COL not in df.columns:
+        return []
+    rois = rois or ICV_ROIS or muse_volumes(df)
+    return [x for x in rois if x in df.columns and icv_norm_name(x) not in df.columns]
+
+def normalize_icv(df, rois=None, scale=ICV_SCALE):
+    ''' Returns a dataframe with the ICV normalized columns of the rois of df
+    '''
+    rois = icv_norm_rois(df, rois)
+    icv = df[ICV_COL].to_numpy(dtype=np.float64) if rois else np.ones(len(df))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals = df[rois].to_numpy(dtype=np.float64) / icv[:, None] * scale
+    return pd.DataFrame(vals, index=df.index, columns=[icv_norm_name(x) for x in rois])
+
+def icv_norm_stage(df, mode=None, rois=None):
+    ''' Normalization stage of the load/upload pipeline
+        rois: ROIs to normalize (default: ICV_ROIS, or all MUSE volumes of df)
+        Returns (df, names of the columns computed on demand)
+    '''
+    mode = mode or ICV_NORM_MODE
+    if mode == 'materialize':
+        norm = normalize_icv(df, rois)
+        if norm.shape[1] > 0:
+            df = pd.concat([df, norm], axis=1)
+        return df, []
+    if mode == 'lazy':
+        return df, [icv_norm_name(x) for x in icv_norm_rois(df, rois)]
+    return df, []
+
+def resolve_columns(df, cols):
+    ''' Returns a dataframe with the columns cols of df, including the ones computed
+        on demand (df itself if all columns are in df)
+        Views are kept in the derived data cache of df, with a key of their own so
+        data derived from them is cached too
+    '''
+    cols = list(dict.fromkeys(cols))
+    if all(c in df.columns for c in cols):
+        return df
+    parent = dataset_key(df)
+    def make_view(df):
+        ## (normalized columns of the ROIs of df)
+        rois = ['MUSE_' + c[len('MUSE_n'):] for c in cols if c not in df.columns and c.startswith('MUSE_n')]
+        norm = normalize_icv(df, rois)
+        view = pd.DataFrame({
+            c: df[c] if c in df.columns else norm[c]
+            for c in cols if c in df.columns or c in norm.columns
+        })
+        _set_key(view, hashlib.sha1((parent + json.dumps(cols)).encode('utf-8')).hexdigest())
+        return view
+    return get_derived(df, ('view', tuple(cols)), make_view)
+
+####### Reference table cache ######
+## Centile tables are converted once to a binary columnar cache:
+##   - numeric columns in a single column-major float64 .npy block
+##   - text columns (e.g. ROI) as integer codes + category names
+## Rows are grouped by the first text column, and a meta.json file keeps the
+## source file stats (mtime, size, sha1) used to detect stale caches.
+## Data files are named by the source sha1 and never modified after writing,
+## so concurrent workers can build and read the cache safely. Data files of a
+## previous version of the source are removed once the new meta.json is
+## written (memory-mapped files stay readable by the processes using them).
+
+def _file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _ref_cache_dir(csv_path):
+    ''' Cache dir of a source file (named by its stem and its resolved path, so
+        files with the same name in different dirs do not share a cache)
+    '''
+    csv_path = pathlib.Path(csv_path)
+    path_hash = hashlib.sha1(str(csv_path.resolve()).encode('utf-8')).hexdigest()[:10]
+    return CACHE_PATH.joinpath("reference", csv_path.stem + "_" + path_hash)
+
+def _write_atomic(out_file, write_fn):
+    tmp_file = out_file.with_name(out_file.name + ".tmp" + str(os.getpid()))
+    with open(tmp_file, 'wb') as f:
+        write_fn(f)
+    os.replace(tmp_file, out_file)
+
+def _read_meta(cache_dir):
+    meta_file = cache_dir.joinpath("meta.json")
+    if not meta_file.exists():
+        return None
+    with open(meta_file) as f:
+        return json.load(f)
+
+def build_ref_cache(csv_path, sha1=None):
+    ''' Converts a reference csv file to the binary cache and returns its meta data
+    '''
+    csv_path = pathlib.Path(csv_path)
+    stat = csv_path.stat()
+    if sha1 is None:
+        sha1 = _file_sha1(csv_path)
+    df = pd.read_csv(csv_path)
+
+    str_cols = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
+    num_cols = [c for c in df.columns if c not in str_cols]
+
+    ## Group rows by the first text column (keeping the original order otherwise)
+    if len(str_cols) > 0:
+        group_codes = pd.factorize(df[str_cols[0]])[0]
+        df = df.iloc[np.argsort(group_codes, kind='stable')].reset_index(drop=True)
+
+    meta = {
+        'source': str(csv_path), 'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1,
+        'columns': [str(c) for c in df.columns], 'num_cols': num_cols, 'str_cols': {},
+        'nrows': len(df),
+    }
+    cache_dir = _ref_cache_dir(csv_path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    values = np.asfortranarray(df[num_cols].to_numpy(dtype=np.float64))
+    meta['values'] = "values-" + sha1[:16] + ".npy"
+    _write_atomic(cache_dir.joinpath(meta['values']), lambda f: np.save(f, values))
+
+    for c in str_cols:
+        c_codes, cats = pd.factorize(df[c])
+        c_file = "codes-" + str(str_cols.index(c)) + "-" + sha1[:16] + ".npy"
+        _write_atomic(cache_dir.joinpath(c_file), lambda f: np.save(f, c_codes.astype(np.int32)))
+        meta['str_cols'][c] = {'file': c_file, 'categories': [str(x) for x in cats]}
+
+    ## Meta data is written last, it marks the cache as complete
+    _write_atomic(cache_dir.joinpath("meta.json"), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+    _remove_stale_files(cache_dir, meta)
+    return meta
+
+def _remove_stale_files(cache_dir, meta):
+    ''' Removes the data files of the cache dir that are not used by meta
+    '''
+    used = {meta['values']} | {x['file'] for x in meta['str_cols'].values()}
+    for in_file in cache_dir.glob("*.npy"):
+        if in_file.name not in used:
+            try:
+                in_file.unlink()
+            except OSError:
+                pass
+
+def get_ref_cache(csv_path):
+    ''' Returns meta data of an up to date cache for the csv file (building it if needed)
+    '''
+    csv_path = pathlib.Path(csv_path)
+    cache_dir = _ref_cache_dir(csv_path)
+    meta = _read_meta(cache_dir)
+    stat = csv_path.stat()
+    if meta is not None and meta['mtime'] == stat.st_mtime and meta['size'] == stat.st_size:
+        return meta
+
+    ## File stats changed: rebuild only if the content changed
+    sha1 = _file_sha1(csv_path)
+    if meta is not None and meta['sha1'] == sha1 and cache_dir.joinpath(meta['values']).exists():
+        meta['mtime'] = stat.st_mtime
+        meta['size'] = stat.st_size
+        _write_atomic(cache_dir.joinpath("meta.json"), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        return meta
+    return build_ref_cache(csv_path, sha1)
+
+def load_ref_table(csv_path):
+    ''' Reads a reference csv file through the binary cache (numeric data is memory-mapped)
+    '''
+    cache_dir = _ref_cache_dir(csv_path)
+    for attempt in range(2):
+        meta = get_ref_cache(csv_path)
+        try:
+            values = np.load(cache_dir.joinpath(meta['values']), mmap_mode='r')
+            codes = {c: np.load(cache_dir.joinpath(c_meta['file']), mmap_mode='r')
+                     for c, c_meta in meta['str_cols'].items()}
+            break
+        except FileNotFoundError:
+            ## (the cache was rebuilt by another process after meta was read)
+            if attempt > 0:
+                raise
+    df = pd.DataFrame(values, columns=meta['num_cols'], copy=False)
+    for c, c_meta in meta['str_cols'].items():
+        df.insert(meta['columns'].index(c), c, pd.Categorical.from_codes(codes[c], c_meta['categories']))
+    return df
+
+####### Centile index ######
+
+def build_centile_index(df, key_col='ROI'):
+    ''' Builds a dict {roi: {col: array}} from a long format centile table
+        Arrays are contiguous slices of a single column-major block (no copies on lookup)
+    '''
+    num_cols = [c for c in df.columns if c != key_col]
+    codes, rois = pd.factorize(df[key_col])
+    order = np.argsort(codes, kind='stable')
+    block = np.asfortranarray(df[num_cols].to_numpy(dtype=np.float64)[order])
+    bounds = np.searchsorted(codes[order], np.arange(len(rois) + 1))
+
+    index = {}
+    for i, roi in enumerate(rois):
+        rows = block[bounds[i]:bounds[i+1]]
+        index[str(roi)] = {c: rows[:, j] for j, c in enumerate(num_cols)}
+    return index
+
+def get_centile_index(df):
+    ''' Returns the (cached) centile index of a reference dataset
+    '''
+    return get_derived(df, 'centile_index', build_centile_index)
+
+####### Upload ingestion ######
+## Uploaded files arrive as a base64 data url. The payload is decoded in
+## chunks by a file-like reader and parsed by pd.read_csv in row chunks, so
+## only the original string, one decoded chunk and the parsed data are in
+## memory at any time. Dtypes are downcast chunk by chunk, and the memory of
+## the parsed data is capped per upload.
+
+UPLOAD_MAX_BYTES = int(os.environ.get("NICHART_UPLOAD_MAX_MB", 512)) * 2**20
+UPLOAD_CHUNK_ROWS = 50000
+UPLOAD_EXTENSIONS = ('.csv',)
+
+class UploadError(Exception):
+    ''' Error while reading an uploaded file (code is a short machine readable tag)
+    '''
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_dict(self, filename):
+        return {'filename': filename, 'code': self.code, 'message': self.message}
+
+class Base64Reader(io.RawIOBase):
+    ''' Binary file-like object decoding base64 text (from position start) in chunks
+    '''
+    def __init__(self, text, start=0, chunk_chars=4 * 2**18):
+        self.text = text
+        self.pos = start
+        self.chunk_chars = chunk_chars
+        self.buf = b''
+        self.nbytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.buf) < len(b) and self.pos < len(self.text):
+            chunk = self.text[self.pos:self.pos + self.chunk_chars]
+            self.pos += len(chunk)
+            try:
+                self.buf += base64.b64decode(chunk, validate=True)
+            except (binascii.Error, ValueError) as e:
+                raise UploadError('decode_error', 'invalid base64 content: ' + str(e))
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        self.nbytes += n
+        return n
+
+def downcast_df(df):
+    ''' Downcasts integer columns to the smallest integer type, and float
+        columns to float32 when this is lossless
+    '''
+    for c in df.columns:
+        if pd.api.types.is_integer_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[c]) and df[c].dtype != np.float32:
+            c32 = df[c].astype(np.float32)
+            if np.array_equal(c32.to_numpy(np.float64), df[c].to_numpy(), equal_nan=True):
+                df[c] = c32
+    return df
+
+def _upload_start(contents):
+    start = contents.find(',') + 1
+    if start == 0 or ';base64' not in contents[:start]:
+        raise UploadError('decode_error', 'expected base64 encoded content')
+    return start
+
+def hash_upload(contents):
+    ''' Content hash (sha1 of the decoded file bytes) of an uploaded file, computed in chunks
+    '''
+    h = hashlib.sha1()
+    reader = Base64Reader(contents, _upload_start(contents))
+    buf = bytearray(2**20)
+    n = reader.readinto(buf)
+    while n > 0:
+        h.update(memoryview(buf)[:n])
+        n = reader.readinto(buf)
+    return h.hexdigest()
+
+def read_upload(contents, filename, max_bytes=None, chunk_rows=UPLOAD_CHUNK_ROWS):
+    ''' Parses an uploaded file (dcc.Upload contents) to a dataframe
+        Raises UploadError
+    '''
+    if max_bytes is None:
+        max_bytes = UPLOAD_MAX_BYTES
+    if not str(filename).lower().endswith(UPLOAD_EXTENSIONS):
+        raise UploadError('unsupported_type', 'unsupported file type (expected: ' + ', '.join(UPLOAD_EXTENSIONS) + ')')
+
+    start = _upload_start(contents)
+
+    chunks = []
+    nbytes = 0
+    reader = io.BufferedReader(Base64Reader(contents, start))
+    try:
+        for chunk in pd.read_csv(reader, chunksize=chunk_rows, encoding='utf-8'):
+            chunk = downcast_df(chunk)
+            nbytes += int(chunk.memory_usage(deep=True).sum())
+            if nbytes > max_bytes:
+                raise UploadError('too_large', f'data exceeds the upload limit of {max_bytes // 2**20} MB')
+            chunks.append(chunk)
+    except UploadError:
+        raise
+    except UnicodeDecodeError as e:
+        raise UploadError('decode_error', 'file is not utf-8 encoded text: ' + str(e))
+    except pd.errors.EmptyDataError:
+        raise UploadError('empty', 'file is empty')
+    except (pd.errors.ParserError, ValueError) as e:
+        raise UploadError('parse_error', 'could not parse csv file: ' + str(e))
+
+    ## (a file with only a header gives one chunk without rows)
+    if sum(len(x) for x in chunks) == 0:
+        raise UploadError('empty', 'file has no data rows')
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
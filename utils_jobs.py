@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import pickle
+import pathlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils_data import CACHE_PATH, sign_bytes, unsign_bytes
+from utils_metrics import pid_alive
+
+####### Background jobs ######
+## Long running computations (e.g. slow plot layers on large datasets) are run
+## by a pool of threads of the process that submits them, so that callbacks
+## return at once and poll the job until it is done. Jobs are identified by a
+## key (e.g. the cache key of the result), and their state is kept in a SQLite
+## database shared by all gunicorn workers:
+##   - a job submitted again (by any session or worker) while it is queued,
+##     running or done is not started again; its state/result is returned
+##   - a pending job whose process died is started again by the next submit
+##   - results are pickled in the database, so any worker can return them
+##     (signed with the key of the dataset files, results with an invalid
+##     signature are ignored)
+## Finished jobs are removed after JOB_KEEP_SECONDS.
+
+JOBS_DB = pathlib.Path(os.environ.get("NICHART_JOBS_DB", CACHE_PATH.joinpath("jobs.sqlite")))
+JOB_WORKERS = int(os.environ.get("NICHART_JOB_WORKERS", 2))
+JOB_KEEP_SECONDS = 24 * 3600.
+JOB_PROGRESS_SECONDS = 0.5
+JOB_PENDING = ('queued', 'running')
+
+class JobQueue:
+    ''' SQLite backed queue of background jobs (run by threads of the submitting process)
+    '''
+    def __init__(self, db_path=JOBS_DB, num_workers=JOB_WORKERS):
+        self.db_path = pathlib.Path(db_path)
+        self.num_workers = num_workers
+        self._executor = None
+        self._pid = None
+        self._running = set()
+        self._lock = threading.Lock()
+        self._db_ready = False
+
+    def _connect(self):
+        ''' New connection (connections are not shared between threads or processes)
+        '''
+        if not self._db_ready:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        if not self._db_ready:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, status TEXT, progress REAL,'
+                ' pid INTEGER, error TEXT, result BLOB, updated REAL)'
+            )
+            self._db_ready = True
+        return con
+
+    def _get_executor(self):
+        ''' Thread pool of this process (threads do not survive a fork, e.g. with
+            gunicorn --preload, so the pool is created on first use in each process)
+        '''
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+                self._pid = os.getpid()
+                self._running = set()
+            return self._executor
+
+    def submit(self, key, fn, retry_failed=True):
+        ''' Starts fn(progress) as job key, unless the same job is pending or done
+            (progress: function called by fn with the completed fraction)
+            retry_failed: start the job again if it failed
+            Returns the job state (see get)
+        '''
+        executor = self._get_executor()
+        con = self._connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            row = con.execute('SELECT status, pid FROM jobs WHERE key = ?', (key,)).fetchone()
+            start = (
+                row is None
+                or (row[0] == 'failed' and retry_failed)
+                or (row[0] in JOB_PENDING and not self._is_alive(key, row[1]))
+            )
+            if start:
+                self._running.add(key)
+                con.execute(
+                    'INSERT OR REPLACE INTO jobs (key, status, progress, pid, error, result, updated)'
+                    ' VALUES (?, ?, 0, ?, NULL, NULL, ?)', (key, 'queued', os.getpid(), time.time())
+                )
+                con.execute('DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated < ?',
+                            JOB_PENDING + (time.time() - JOB_KEEP_SECONDS,))
+            con.execute('COMMIT')
+        finally:
+            con.close()
+        if start:
+            executor.submit(self._run, key, fn)
+        return self.get(key)
+
+    def _is_alive(self, key, pid):
+        ''' Checks if the process running a job is still there
+        '''
+        if pid == os.getpid():
+            return key in self._running
+        return pid_alive(pid)
+
+    def _update(self, key, **fields):
+        ''' Updates the state of a job (if it was not taken over by another process)
+        '''
+        names = sorted(fields)
+        con = self._connect()
+        try:
+            con.execute(
+                'UPDATE jobs SET ' + ', '.join(f'{x} = ?' for x in names) + ', updated = ? WHERE key = ? AND pid = ?',
+                [fields[x] for x in names] + [time.time(), key, os.getpid()]
+            )
+        finally:
+            con.close()
+
+    def _run(self, key, fn):
+        self._update(key, status='running')
+        last = [time.monotonic()]
+        def progress(frac):
+            now = time.monotonic()
+            if now - last[0] >= JOB_PROGRESS_SECONDS:
+                last[0] = now
+                self._update(key, progress=float(frac))
+        try:
+            result = fn(progress)
+            self._update(key, status='done', progress=1., result=sign_bytes(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+        except Exception as e:
+            print('Warning: background job failed: ', key, e)
+            self._update(key, status='failed', error=str(e))
+        finally:
+            self._running.discard(key)
+
+    def get(self, key):
+        ''' Returns the state {'key', 'status', 'progress', 'error'} of a job
+            (None if it is unknown, or pending in a process that died)
+        '''
+        con = self._connect()
+        try:
+            row = con.execute('SELECT status, progress, pid, error FROM jobs WHERE key = ?', (key,)).fetchone()
+        finally:
+            con.close()
+        if row is None or (row[0] in JOB_PENDING and not self._is_alive(key, row[2])):
+            return None
+        return {'key': key, 'status': row[0], 'progress': row[1], 'error': row[3]}
+
+    def result(self, key):
+        ''' Returns the result of a finished job (None if it is not done)
+            A result with an invalid signature is ignored and the job is marked
+            as failed, so that it is started again
+        '''
+        con = self._connect()
+        try:
+            row = con.execute('SELECT result FROM jobs WHERE key = ? AND status = ?', (key, 'done')).fetchone()
+            data = None if row is None else unsign_bytes(row[0])
+            if row is not None and data is None:
+                print('Warning: job result with an invalid signature, ignored: ', key)
+                con.execute('UPDATE jobs SET status = ?, error = ?, result = NULL, updated = ? WHERE key = ?',
+                            ('failed', 'invalid result signature', time.time(), key))
+        finally:
+            con.close()
+        return None if data is None else pickle.loads(data)
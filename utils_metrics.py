@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import atexit
+import pathlib
+import threading
+import contextlib
+import flask
+try:
+    import fcntl
+except ImportError:
+    ## (Windows: the app runs in a single process, files are not locked)
+    fcntl = None
+from utils_data import CACHE_PATH
+
+####### Callback metrics ######
+## All server callbacks of a dash app are requests to CALLBACK_PATH, so they
+## are measured by request hooks on the Flask server (no wrapping of the
+## callback functions). Requests are labelled by the output of the callback
+## (the id under which dash registers it; requests for unknown outputs are
+## labelled "unknown"), and for each callback we keep:
+##   - a histogram of durations (seconds)
+##   - a histogram of response sizes and the total request size (bytes)
+##   - the number of errors (responses with status >= 400)
+## Each process (gunicorn worker) writes its metrics to <pid>.json in
+## METRICS_DIR at most every METRICS_FLUSH_SECONDS; the /metrics route sums
+## the files of all live workers and returns them in Prometheus text format.
+## The files of dead workers (e.g. restarted by gunicorn) are added to the
+## ACCUMULATED_FILE (under a file lock) and removed, so counters never drop.
+
+METRICS_DIR = pathlib.Path(os.environ.get("NICHART_METRICS_DIR", CACHE_PATH.joinpath("metrics")))
+METRICS_FLUSH_SECONDS = 1.
+CALLBACK_PATH = '/_dash-update-component'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+ACCUMULATED_FILE = 'accumulated.json'
+
+def _new_entry():
+    return {
+        'count': 0, 'errors': 0,
+        'duration_buckets': [0] * (len(DURATION_BUCKETS) + 1), 'duration_sum': 0.,
+        'size_out_buckets': [0] * (len(SIZE_BUCKETS) + 1), 'size_out_sum': 0,
+        'size_in_sum': 0,
+    }
+
+def _merge(total, data):
+    ''' Adds metrics (by callback) to total
+    '''
+    for callback, entry in data.items():
+        acc = total.setdefault(callback, _new_entry())
+        for k, v in entry.items():
+            acc[k] = [a + b for a, b in zip(acc[k], v)] if isinstance(v, list) else acc[k] + v
+    return total
+
+def _read_json(in_file):
+    try:
+        return json.loads(in_file.read_text())
+    except (OSError, ValueError):
+        return None
+
+def _write_text(out_file, text):
+    tmp_file = out_file.with_suffix('.tmp')
+    tmp_file.write_text(text)
+    os.replace(tmp_file, out_file)
+
+@contextlib.contextmanager
+def _file_lock(lock_file):
+    with open(lock_file, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _bucket(buckets, value):
+    for i, b in enumerate(buckets):
+        if value <= b:
+            return i
+    return len(buckets)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class CallbackMetrics:
+    ''' Latency, payload size and error metrics of the dash callbacks of this process
+    '''
+    def __init__(self, callback_map=None, metrics_dir=METRICS_DIR):
+        self.callback_map = callback_map
+        self.metrics_dir = pathlib.Path(metrics_dir)
+        self.data = {}
+        self.last_flush = 0.
+        self._lock = threading.Lock()
+
+    def init_app(self, server):
+        ''' Registers the request hooks and the /metrics route on a Flask server
+        '''
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+        server.add_url_rule('/metrics', 'metrics', self._metrics_view)
+        atexit.register(self.flush, True)
+
+    def observe(self, callback, seconds, size_in, size_out, error=False):
+        with self._lock:
+            entry = self.data.setdefault(callback, _new_entry())
+            entry['count'] += 1
+            entry['errors'] += int(error)
+            entry['duration_buckets'][_bucket(DURATION_BUCKETS, seconds)] += 1
+            entry['duration_sum'] += seconds
+            entry['size_out_buckets'][_bucket(SIZE_BUCKETS, size_out)] += 1
+            entry['size_out_sum'] += size_out
+            entry['size_in_sum'] += size_in
+        self.flush()
+
+    def flush(self, force=False):
+        ''' Writes the metrics of this process to its file in the metrics dir
+        '''
+        now = time.monotonic()
+        if not force and now - self.last_flush < METRICS_FLUSH_SECONDS:
+            return
+        self.last_flush = now
+        with self._lock:
+            text = json.dumps(self.data)
+        try:
+            self.metrics_dir.mkdir(parents=True, exist_ok=True)
+            _write_text(self.metrics_dir.joinpath(f'{os.getpid()}.json'), text)
+        except OSError as e:
+            print('Warning: could not write callback metrics: ', e)
+
+    def collect(self):
+        ''' Returns the metrics summed over all processes (live ones and the
+            accumulated metrics of dead ones), and the number of live processes
+        '''
+        self.flush(True)
+        total, num_proc, dead = {}, 0, []
+        for in_file in self.metrics_dir.glob('*.json'):
+            if not in_file.stem.isdigit():
+                continue
+            if not pid_alive(int(in_file.stem)):
+                dead.append(in_file)
+                continue
+            data = _read_json(in_file)
+            if data is None:
+                continue
+            num_proc += 1
+            _merge(total, data)
+        _merge(total, self._accumulate(dead))
+        return total, num_proc
+
+    def _accumulate(self, dead_files):
+        ''' Adds the metrics files of dead processes to the accumulated file and
+            removes them; returns the accumulated metrics
+        '''
+        acc_file = self.metrics_dir.joinpath(ACCUMULATED_FILE)
+        if not dead_files:
+            return _read_json(acc_file) or {}
+        try:
+            with _file_lock(self.metrics_dir.joinpath('accumulated.lock')):
+                acc = _read_json(acc_file) or {}
+                ## (files already added by another process are gone)
+                dead_files = [x for x in dead_files if x.exists()]
+                if dead_files:
+                    for in_file in dead_files:
+                        _merge(acc, _read_json(in_file) or {})
+                    _write_text(acc_file, json.dumps(acc))
+                    for in_file in dead_files:
+                        in_file.unlink()
+        except OSError as e:
+            print('Warning: could not accumulate callback metrics: ', e)
+            acc = _read_json(acc_file) or {}
+        return acc
+
+    def prometheus_text(self):
+        ''' Metrics in Prometheus text exposition format
+        '''
+        data, num_proc = self.collect()
+        lines = [
+            '# HELP nichart_metrics_processes Number of processes reporting metrics',
+            '# TYPE nichart_metrics_processes gauge',
+            f'nichart_metrics_processes {num_proc}',
+        ]
+        for name, help_text, buckets, key in [
+            ('nichart_callback_duration_seconds', 'Duration of dash callback requests', DURATION_BUCKETS, 'duration'),
+            ('nichart_callback_response_bytes', 'Size of dash callback responses', SIZE_BUCKETS, 'size_out'),
+        ]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for callback, entry in sorted(data.items()):
+                label = f'callback="{_escape(callback)}"'
+                cum = 0
+                for b, n in zip(list(buckets) + ['+Inf'], entry[key + '_buckets']):
+                    cum += n
+                    lines.append(f'{name}_bucket{{{label},le="{b}"}} {cum}')
+                lines.append(f'{name}_sum{{{label}}} {entry[key + "_sum"]}')
+                lines.append(f'{name}_count{{{label}}} {entry["count"]}')
+        for name, help_text, key in [
+            ('nichart_callback_request_bytes_total', 'Total size of dash callback requests', 'size_in_sum'),
+            ('nichart_callback_errors_total', 'Number of failed dash callback requests', 'errors'),
+        ]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for callback, entry in sorted(data.items()):
+                lines.append(f'{name}{{callback="{_escape(callback)}"}} {entry[key]}')
+        return '\n'.join(lines) + '\n'
+
+    ## Request hooks
+    def _before_request(self):
+        if flask.request.path == CALLBACK_PATH:
+            flask.g.metrics_t0 = time.perf_counter()
+
+    def _after_request(self, response):
+        t0 = flask.g.pop('metrics_t0', None)
+        if t0 is not None:
+            body = flask.request.get_json(silent=True) or {}
+            callback = body.get('output')
+            if self.callback_map is not None and callback not in self.callback_map:
+                callback = 'unknown'
+            self.observe(
+                str(callback), time.perf_counter() - t0,
+                flask.request.content_length or 0, response.calculate_content_length() or 0,
+                response.status_code >= 400,
+            )
+        return response
+
+    def _metrics_view(self):
+        return flask.Response(self.prometheus_text(), mimetype='text/plain; version=0.0.4')
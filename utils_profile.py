@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import pathlib
+import itertools
+import flask
+from utils_data import CACHE_PATH
+
+####### Request profiling ######
+## Dash callback requests can be profiled with cProfile, one request at a
+## time. Profiling is off by default, and is switched on:
+##   - for all callback requests with NICHART_PROFILE=1 (at startup)
+##   - for a single request with the query parameter ?profile=1 or the header
+##     X-Profile: 1 (e.g. when replaying a request)
+##   - on running workers by creating the file PROFILE_DIR/enable; each line
+##     of the file is a filter (a request is profiled if a line is found in
+##     its callback output id or its input values), an empty file profiles
+##     all requests. The file is checked at most every PROFILE_CHECK_SECONDS.
+## Each profile is written to PROFILE_DIR as <time>-<pid>-<n>.prof (pstats
+## format, e.g. for snakeviz) with a .json file of tags (callback output id,
+## input values, duration, status). Only the last PROFILE_KEEP profiles are kept.
+
+PROFILE_DIR = pathlib.Path(os.environ.get("NICHART_PROFILE_DIR", CACHE_PATH.joinpath("profiles")))
+PROFILE_KEEP = int(os.environ.get("NICHART_PROFILE_KEEP", 50))
+PROFILE_CHECK_SECONDS = 1.
+PROFILE_MAX_VALUE_CHARS = 200
+CALLBACK_PATH = '/_dash-update-component'
+
+def _short(value):
+    ''' Input value for the tags of a profile (long values are truncated)
+    '''
+    text = json.dumps(value, default=str)
+    if len(text) > PROFILE_MAX_VALUE_CHARS:
+        return text[:PROFILE_MAX_VALUE_CHARS] + '...'
+    return value
+
+def _tag_values(items):
+    ''' (id, property, value) of the inputs or states of a callback request
+        (pattern-matching inputs with ALL are lists of items)
+    '''
+    out = []
+    for x in items:
+        for y in (x if isinstance(x, list) else [x]):
+            out.append({'id': y.get('id'), 'property': y.get('property'), 'value': _short(y.get('value'))})
+    return out
+
+class RequestProfiler:
+    ''' Profiles dash callback requests on demand
+    '''
+    def __init__(self, profile_dir=PROFILE_DIR, keep=PROFILE_KEEP, always=None):
+        self.profile_dir = pathlib.Path(profile_dir)
+        self.keep = keep
+        if always is None:
+            always = os.environ.get("NICHART_PROFILE", "0") not in ("", "0")
+        self.always = always
+        self.filters = None
+        self.last_check = 0.
+        self._counter = itertools.count()
+
+    def init_app(self, server):
+        ''' Registers the request hooks on a Flask server
+        '''
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+
+    def get_filters(self):
+        ''' Filters of the enable file (None if profiling is not enabled by the file)
+        '''
+        now = time.monotonic()
+        if now - self.last_check >= PROFILE_CHECK_SECONDS:
+            self.last_check = now
+            try:
+                lines = self.profile_dir.joinpath('enable').read_text().splitlines()
+                self.filters = [x.strip() for x in lines if x.strip()]
+            except OSError:
+                self.filters = None
+        return self.filters
+
+    def should_profile(self, body):
+        req = flask.request
+        if self.always or req.args.get('profile') == '1' or req.headers.get('X-Profile') == '1':
+            return True
+        filters = self.get_filters()
+        if filters is None:
+            return False
+        if not filters:
+            return True
+        text = str(body.get('output')) + json.dumps(body.get('inputs'), default=str)
+        return any(x in text for x in filters)
+
+    def write_profile(self, prof, tags):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._counter)}"
+        prof.dump_stats(str(self.profile_dir.joinpath(stem + '.prof')))
+        self.profile_dir.joinpath(stem + '.json').write_text(json.dumps(tags, indent=1, default=str))
+        self.rotate()
+
+    def rotate(self):
+        ''' Removes the oldest profiles (keeps the last self.keep)
+        '''
+        files = sorted(self.profile_dir.glob('*.prof'), key=lambda x: x.stat().st_mtime)
+        for prof_file in files[:max(0, len(files) - self.keep)]:
+            for f in (prof_file, prof_file.with_suffix('.json')):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+
+    ## Request hooks
+    def _before_request(self):
+        if flask.request.path != CALLBACK_PATH:
+            return
+        body = flask.request.get_json(silent=True) or {}
+        if self.should_profile(body):
+            import cProfile
+            flask.g.profiler = cProfile.Profile()
+            flask.g.profiler_t0 = time.perf_counter()
+            flask.g.profiler.enable()
+
+    def _after_request(self, response):
+        prof = flask.g.pop('profiler', None)
+        if prof is None:
+            return response
+        prof.disable()
+        body = flask.request.get_json(silent=True) or {}
+        tags = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pid': os.getpid(),
+            'output': body.get('output'),
+            'inputs': _tag_values(body.get('inputs', [])),
+            'state': _tag_values(body.get('state', [])),
+            'duration': time.perf_counter() - flask.g.pop('profiler_t0'),
+            'status': response.status_code,
+        }
+        try:
+            self.write_profile(prof, tags)
+        except OSError as e:
+            print('Warning: could not write request profile: ', e)
+        return response
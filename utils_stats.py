@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+import pandas as pd
+from utils_data import get_derived, has_derived, dataset_key, get_centile_index
+
+####### Lowess ######
+## Local linear regression with tricube weights (and bisquare robustness
+## iterations), evaluated on a fixed grid of output points.
+##   - data is sorted once; the k nearest neighbours of a grid point form a
+##     contiguous window of the sorted data, found by binary search
+##   - exact mode: weighted sums over the window of each grid point (O(G*k))
+##   - approximate mode: data is binned on x, weighted moments are summed per
+##     bin in one pass, and the weight of a point is evaluated at the mean x of
+##     its bin (O(n + G*B)).
+## Error bound of the approximate mode: the tricube function is Lipschitz with
+## constant TRICUBE_LIPSCHITZ, so the weight of every point differs from its
+## exact value by at most TRICUBE_LIPSCHITZ * bin_width / h, where h is the
+## (smallest) window half width. The number of bins is chosen so that this
+## bound is below `tol`.
+
+TRICUBE_LIPSCHITZ = 2.01
+LOWESS_APPROX_MIN_POINTS = 50000
+LOWESS_MAX_BINS = 2**16
+
+def _tricube(u):
+    u = np.clip(np.abs(u), 0, 1)
+    return (1 - u**3)**3
+
+def _knn_bandwidth(xs, grid, k):
+    ''' Distance from each grid point to its k-th nearest neighbour in sorted xs
+    '''
+    n = len(xs)
+    ## Binary search for the first window [lo, lo+k) that is not improved by shifting right
+    lo = np.clip(np.searchsorted(xs, grid) - k, 0, n - k)
+    hi = np.clip(np.searchsorted(xs, grid), 0, n - k)
+    while np.any(lo < hi):
+        mid = (lo + hi) // 2
+        shift = (grid - xs[mid]) > (xs[np.minimum(mid + k, n - 1)] - grid)
+        shift &= (mid + k < n)
+        lo = np.where(shift, mid + 1, lo)
+        hi = np.where(shift, hi, mid)
+    h = np.maximum(grid - xs[lo], xs[lo + k - 1] - grid)
+    return lo, np.maximum(h, 1e-12) * 1.0000001
+
+def _solve_local_linear(grid, S):
+    ''' Local linear fit at grid points from weighted sums S = [W, WX, WXX, WY, WXY]
+    '''
+    W, WX, WXX, WY, WXY = S
+    det = W * WXX - WX**2
+    ok = np.abs(det) > 1e-12 * np.maximum(W * WXX, 1e-300)
+    slope = np.where(ok, (W * WXY - WX * WY) / np.where(ok, det, 1), 0)
+    icept = (WY - slope * WX) / np.where(W > 0, W, 1)
+    return np.where(W > 0, icept + slope * grid, np.nan)
+
+def lowess_fit(x, y, frac=1./3, it=3, grid_size=200, approx=None, tol=0.01, progress=None):
+    ''' Lowess smoother evaluated on a grid of grid_size points spanning the data
+        approx: None (auto: for more than LOWESS_APPROX_MIN_POINTS points), True or False
+        tol: bound on the per point weight error in approximate mode
+        progress: optional function called with the completed fraction
+        Returns (grid, fitted values on the grid)
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    order = np.argsort(x[ok], kind='stable')
+    xs = x[ok][order]
+    ys = y[ok][order]
+
+    n = len(xs)
+    if n < 2:
+        return xs, ys
+    k = min(n, max(2, int(math.ceil(frac * n))))
+    ## Centre x for numerical stability of the weighted sums
+    x0 = xs[n // 2]
+    xs = xs - x0
+    grid = np.linspace(xs[0], xs[-1], grid_size)
+    lo, h = _knn_bandwidth(xs, grid, k)
+    if approx is None:
+        approx = n > LOWESS_APPROX_MIN_POINTS
+
+    if approx:
+        ## Number of bins keeping the weight error below tol
+        nbins = int(min(LOWESS_MAX_BINS, max(1, math.ceil(TRICUBE_LIPSCHITZ * (xs[-1] - xs[0]) / (tol * h.min())))))
+        bin_idx = np.minimum(((xs - xs[0]) / max(xs[-1] - xs[0], 1e-12) * nbins).astype(np.int64), nbins - 1)
+
+    rw = np.ones(n)
+    for i in range(it + 1):
+        if approx:
+            mom = np.vstack([
+                np.bincount(bin_idx, weights=v, minlength=nbins)
+                for v in (rw, rw * xs, rw * xs**2, rw * ys, rw * xs * ys)
+            ])
+            cnt = np.bincount(bin_idx, minlength=nbins)
+            xbin = np.where(cnt > 0, np.bincount(bin_idx, weights=xs, minlength=nbins) / np.maximum(cnt, 1), 0)
+            S = np.zeros((5, grid_size))
+            for j0 in range(0, grid_size, 64):
+                j1 = min(grid_size, j0 + 64)
+                t = _tricube((xbin[None, :] - grid[j0:j1, None]) / h[j0:j1, None])
+                S[:, j0:j1] = mom @ t.T
+        else:
+            S = np.zeros((5, grid_size))
+            for j in range(grid_size):
+                sl = slice(lo[j], lo[j] + k)
+                xw = xs[sl]
+                w = _tricube((xw - grid[j]) / h[j]) * rw[sl]
+                wx = w * xw
+                S[:, j] = [w.sum(), wx.sum(), (wx * xw).sum(), (w * ys[sl]).sum(), (wx * ys[sl]).sum()]
+        yfit = _solve_local_linear(grid, S)
+        if progress is not None:
+            progress((i + 1) / (it + 1))
+        if i == it:
+            break
+
+        ## Bisquare robustness weights from residuals at the data points
+        res = ys - np.interp(xs, grid, yfit)
+        s = np.median(np.abs(res))
+        if s <= 0:
+            break
+        rw = (1 - np.clip(res / (6 * s), -1, 1)**2)**2
+
+    return grid + x0, yfit
+
+####### Linear regression ######
+## y = intercept + slope * x fitted for all columns at once: the sufficient
+## statistics of all columns are computed with a few matrix products (missing
+## values are masked per column), and the closed form solution is applied
+## column-wise.
+
+def linreg_fit_all(df, xvar, cols=None):
+    ''' Fits col ~ xvar for every numeric column (or the given cols) in one pass
+        Returns a DataFrame indexed by column name with slope, intercept, r2,
+        se_slope, se_intercept, n, x_min and x_max
+    '''
+    if cols is None:
+        cols = [c for c in df.columns if c != xvar and pd.api.types.is_numeric_dtype(df[c])]
+    x = df[xvar].to_numpy(dtype=np.float64)
+    Y = df[cols].to_numpy(dtype=np.float64)
+
+    ## Mask of valid values, centred x for numerical stability
+    M = (np.isfinite(x)[:, None] & np.isfinite(Y))
+    c = np.nanmean(x) if np.isfinite(x).any() else 0.
+    xc = np.where(np.isfinite(x), x - c, 0)
+    Y0 = np.where(M, Y, 0)
+    Mf = M.astype(np.float64)
+
+    n = Mf.sum(0)
+    sx = xc @ Mf
+    sxx = (xc**2) @ Mf
+    sy = Y0.sum(0)
+    sxy = xc @ Y0
+    syy = (Y0**2).sum(0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ss_xx = sxx - sx**2 / n
+        ss_yy = syy - sy**2 / n
+        ss_xy = sxy - sx * sy / n
+        slope = ss_xy / ss_xx
+        icept_c = (sy - slope * sx) / n
+        sse = np.maximum(ss_yy - slope * ss_xy, 0)
+        r2 = 1 - sse / ss_yy
+        sigma2 = sse / (n - 2)
+        xbar = sx / n + c
+        se_slope = np.sqrt(sigma2 / ss_xx)
+        se_icept = np.sqrt(sigma2 * (1 / n + xbar**2 / ss_xx))
+
+    x_all = np.broadcast_to(x[:, None], M.shape)
+    return pd.DataFrame({
+        'slope': slope,
+        'intercept': icept_c - slope * c,
+        'r2': r2,
+        'se_slope': se_slope,
+        'se_intercept': se_icept,
+        'n': n.astype(np.int64),
+        'x_min': np.where(M, x_all, np.inf).min(0) if len(x) > 0 else np.nan,
+        'x_max': np.where(M, x_all, -np.inf).max(0) if len(x) > 0 else np.nan,
+    }, index=pd.Index(cols, name='ROI'))
+
+def get_linreg_table(df, xvar):
+    ''' Returns the (cached) linear fits of all numeric columns on xvar
+    '''
+    return get_derived(df, ('linreg', xvar), lambda d: linreg_fit_all(d, xvar))
+
+####### Centile curves ######
+## Reference centile curves are fitted by kernel-weighted quantiles: at each
+## point of an age grid, the centiles are the weighted quantiles of the
+## values of the subjects, with tricube weights on age. The kernel half width
+## is the larger of `bandwidth` and the distance to the min_points-th nearest
+## subject (as in lowess), so sparse age ranges are smoothed over enough
+## subjects. Curves are made monotone across centiles.
+
+CENTILE_LEVELS = (5, 10, 25, 50, 75, 90, 95)
+
+def weighted_quantiles(y, w, q):
+    ''' Quantiles q (in [0, 1]) of values y with weights w (midpoint rule)
+    '''
+    order = np.argsort(y, kind='stable')
+    ys, ws = y[order], w[order]
+    cum = np.cumsum(ws)
+    return np.interp(q, (cum - 0.5 * ws) / cum[-1], ys)
+
+def fit_centile_curves(x, y, ages, levels=CENTILE_LEVELS, bandwidth=None, min_points=200):
+    ''' Centile curves of y as a function of x, evaluated at ages
+        bandwidth: minimum kernel half width (default: 5% of the range of x)
+        Returns an array (ages x levels)
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    order = np.argsort(x[ok], kind='stable')
+    xs, ys = x[ok][order], y[ok][order]
+    ages = np.asarray(ages, dtype=np.float64)
+    q = np.asarray(levels, dtype=np.float64) / 100
+
+    out = np.full((len(ages), len(q)), np.nan)
+    n = len(xs)
+    if n == 0:
+        return out
+    if bandwidth is None:
+        bandwidth = 0.05 * max(xs[-1] - xs[0], 1e-12)
+    lo, h = _knn_bandwidth(xs, ages, min(n, max(1, min_points)))
+    h = np.maximum(h, bandwidth)
+    for j, a in enumerate(ages):
+        i0, i1 = np.searchsorted(xs, [a - h[j], a + h[j]])
+        w = _tricube((xs[i0:i1] - a) / h[j])
+        if w.sum() > 0:
+            out[j] = weighted_quantiles(ys[i0:i1], w, q)
+    return np.maximum.accumulate(out, axis=1)
+
+####### Level of detail sampling ######
+## Large scatter plots are drawn from a bounded sample of the points inside
+## the visible x window. The rows are sorted once on x, so selecting a window
+## is a binary search. The window is split in equal width x bins, each bin
+## gets a share of the sample proportional to its count (density preserving,
+## evenly spaced in x order), and the points with the min/max y of each bin
+## and the first/last points of the window are always kept.
+
+def get_sort_index(df, xvar, yvar):
+    ''' Returns (row positions sorted on xvar, sorted x, y in the same order)
+        for rows with finite x (cached per dataset)
+    '''
+    def build(d):
+        x = d[xvar].to_numpy(dtype=np.float64)
+        order = np.argsort(x, kind='stable')
+        order = order[np.isfinite(x[order])]
+        return order, x[order]
+    order, xs = get_derived(df, ('sort_index', xvar), build)
+    ys = get_derived(df, ('sort_index', xvar, yvar), 
+                     lambda d: d[yvar].to_numpy(dtype=np.float64)[order])
+    return order, xs, ys
+
+def lod_sample(df, xvar, yvar, max_points, x_range=None, nbins=50):
+    ''' Returns row positions of a density preserving sample of about max_points
+        rows with xvar in x_range (all rows in the window if there are fewer)
+    '''
+    order, xs, ys = get_sort_index(df, xvar, yvar)
+    lo, hi = 0, len(xs)
+    if x_range is not None:
+        lo = np.searchsorted(xs, x_range[0], 'left')
+        hi = np.searchsorted(xs, x_range[1], 'right')
+    num = hi - lo
+    if num <= max_points:
+        return order[lo:hi]
+
+    ## Bin bounds (positions in the sorted data)
+    edges = np.linspace(xs[lo], xs[hi - 1], nbins + 1)
+    bounds = np.concatenate([[lo], np.searchsorted(xs, edges[1:-1], 'left'), [hi]])
+    counts = np.diff(bounds)
+    quota = np.floor(counts * max(max_points - 2 * nbins - 2, nbins) / num).astype(np.int64)
+
+    ## Evenly spaced points in each bin, y extremes of each bin, window end points
+    y_fin = np.where(np.isfinite(ys), ys, np.nan)
+    sel = [np.array([lo, hi - 1])]
+    for b in np.nonzero(counts)[0]:
+        b0, c, q = bounds[b], counts[b], quota[b]
+        if q > 0:
+            sel.append(b0 + (np.arange(q) * c) // q)
+        y_bin = y_fin[b0:b0 + c]
+        if np.isfinite(y_bin).any():
+            sel.append(b0 + np.array([np.nanargmin(y_bin), np.nanargmax(y_bin)]))
+    return order[np.unique(np.concatenate(sel))]
+
+####### Centile scoring ######
+## User subjects are scored against a reference centile table (long format:
+## ROI, Age, centile_5 ... centile_95). For each ROI the centile curves are
+## interpolated linearly at the age of every subject (ages outside the
+## reference range are clamped), and the value of the subject is placed
+## between the curves in z space: with z_k the normal quantile of centile k,
+## z is interpolated linearly between the two nearest curves (extrapolated
+## from the outer pair beyond the first/last centile), and the centile of the
+## subject is 100 * Phi(z).
+## ROIs sharing the same age grid are scored together as (ROIs x subjects)
+## arrays, in chunks of at most CENTILE_CHUNK_ELEMS elements.
+
+CENTILE_CHUNK_ELEMS = 2**19
+
+def _norm_cdf(z):
+    ''' Standard normal cdf (erf approximation of Abramowitz & Stegun 7.1.26,
+        absolute error < 1e-7)
+    '''
+    x = np.abs(z) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-x**2)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+## Coefficients of the inverse normal cdf approximation of P. J. Acklam
+_PPF_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+          1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_PPF_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+          6.680131188771972e+01, -1.328068155288572e+01)
+_PPF_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+          -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_PPF_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+          3.754408661907416e+00)
+_PPF_LOW = 0.02425
+
+def _polyval(coefs, x):
+    out = np.zeros_like(x)
+    for c in coefs:
+        out = out * x + c
+    return out
+
+def _norm_ppf(p):
+    ''' Standard normal inverse cdf, for p in (0, 1) (Acklam's rational
+        approximation, relative error < 1.2e-9; statistics.NormalDist is not in python 3.7)
+    '''
+    p = np.asarray(p, dtype=np.float64)
+    ## Lower and upper tails (by symmetry), and central region
+    q = np.sqrt(-2 * np.log(np.where(p < 0.5, p, 1 - p)))
+    tail = _polyval(_PPF_C, q) / (_polyval(_PPF_D, q) * q + 1)
+    tail = np.where(p < 0.5, tail, -tail)
+    q = p - 0.5
+    r = q * q
+    central = _polyval(_PPF_A, r) * q / (_polyval(_PPF_B, r) * r + 1)
+    return np.where((p >= _PPF_LOW) & (p <= 1 - _PPF_LOW), central, tail)
+
+def centile_columns(df_ref):
+    ''' Returns the centile columns of a reference table and their levels (in %)
+    '''
+    cols = [c for c in df_ref.columns if str(c).startswith('centile_')]
+    levels = np.array([float(c.split('_', 1)[1]) for c in cols])
+    order = np.argsort(levels, kind='stable')
+    return [cols[i] for i in order], levels[order]
+
+def _score_group(x, Y, ages, R, zk):
+    ''' z scores of values Y (subjects x ROIs) at ages x, for ROIs sharing the
+        age grid ages, with centile curves R (centiles x ROIs x ages)
+    '''
+    if len(ages) == 1:
+        ages, R = np.repeat(ages, 2), np.repeat(R, 2, axis=2)
+    num_cent = len(zk)
+    ## Age interval and interpolation weight of each subject
+    j = np.clip(np.searchsorted(ages, x, 'right') - 1, 0, len(ages) - 2)
+    t = np.clip((x - ages[j]) / (ages[j + 1] - ages[j]), 0, 1)
+    ## Curves as value and slope per age interval (flat arrays, indexed by
+    ## (centile * num_rois + roi) * num_intervals + interval)
+    num_rois, num_int = R.shape[1], len(ages) - 1
+    A = R[:, :, :-1].ravel()
+    B = np.diff(R, axis=2).ravel()
+
+    Z = np.empty(Y.shape)
+    step = max(1, CENTILE_CHUNK_ELEMS // num_rois)
+    for i0 in range(0, len(x), step):
+        i1 = min(len(x), i0 + step)
+        tc = t[i0:i1]
+        v = Y[i0:i1].T
+        pos = np.arange(num_rois)[:, None] * num_int + j[i0:i1]
+        ## Segment between centile curves containing each value (ROIs x subjects)
+        k = np.full(v.shape, -1)
+        for c in range(num_cent):
+            ic = pos + c * num_rois * num_int
+            k += (A[ic] + tc * B[ic]) <= v
+        k = np.clip(k, 0, num_cent - 2)
+        ic = pos + k * (num_rois * num_int)
+        q0 = A[ic] + tc * B[ic]
+        ic += num_rois * num_int
+        q1 = A[ic] + tc * B[ic]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(q1 > q0, (v - q0) / (q1 - q0), 0.5)
+        Z[i0:i1] = (zk[k] + frac * (zk[k + 1] - zk[k])).T
+    return Z
+
+def score_centiles(df, df_ref, xvar='Age', rois=None, progress=None):
+    ''' Centile and z score of every subject of df for every ROI, relative to the
+        reference centile table df_ref
+        rois: ROIs to score (default: all columns of df with reference centiles)
+        progress: optional function called with the completed fraction
+        Returns (centiles, z scores) as DataFrames indexed like df, with a column per ROI
+    '''
+    index = get_centile_index(df_ref)
+    if rois is None:
+        rois = [c for c in df.columns if c in index]
+    cols, levels = centile_columns(df_ref)
+    zk = _norm_ppf(np.asarray(levels, dtype=np.float64) / 100)
+
+    x = df[xvar].to_numpy(dtype=np.float64)
+    Y = df[rois].to_numpy(dtype=np.float64)
+    Z = np.full(Y.shape, np.nan)
+
+    ## ROIs with the same age grid
+    groups = {}
+    for i, roi in enumerate(rois):
+        groups.setdefault(index[roi][xvar].tobytes(), []).append(i)
+    for k, sel in enumerate(groups.values()):
+        ages = index[rois[sel[0]]][xvar]
+        order = np.argsort(ages, kind='stable')
+        R = np.array([[index[rois[i]][c][order] for i in sel] for c in cols])
+        ## Centile curves are made monotone across centiles
+        R = np.maximum.accumulate(R, axis=0)
+        Z[:, sel] = _score_group(x, Y[:, sel], ages[order], R, zk)
+        if progress is not None:
+            progress((k + 1) / len(groups))
+
+    Z[~np.isfinite(x)] = np.nan
+    zscores = pd.DataFrame(Z, index=df.index, columns=rois)
+    centiles = pd.DataFrame(100 * _norm_cdf(Z), index=df.index, columns=rois)
+    return centiles, zscores
+
+def get_centile_scores(df, df_ref, xvar='Age', progress=None):
+    ''' Returns the (cached) centile scores of a user dataset relative to a reference
+    '''
+    return get_derived(df, ('centile_scores', dataset_key(df_ref), xvar), 
+                       lambda d: score_centiles(d, df_ref, xvar, progress=progress))
+
+def has_centile_scores(df, df_ref, xvar='Age'):
+    ''' Checks if the centile scores of a user dataset are cached (in this process)
+    '''
+    return has_derived(df, ('centile_scores', dataset_key(df_ref), xvar))
+
+####### Binned statistics ######
+## Statistics of y in bins of x (e.g. age bins), for aggregated plots whose
+## size does not depend on the number of subjects (bars, boxes, violins).
+## Bins are aligned on multiples of the bin width (same bins for all
+## datasets). All statistics of a column are computed in one pass:
+##   - count, mean and SD with np.bincount
+##   - quantiles from the data sorted by (bin, y) (a sort by y, then a stable
+##     sort by bin, which is a radix sort for small integers), interpolated
+##     linearly within each bin
+##   - kernel density outlines: a histogram of y per bin on a grid of
+##     BIN_KDE_POINTS values (one np.bincount), smoothed by a gaussian kernel
+##     with the bandwidth of each bin (Silverman's rule)
+
+BIN_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+BIN_KDE_POINTS = 64
+
+def _kde_bandwidth(count, sd, iqr):
+    ''' Bandwidth of a gaussian kernel (Silverman's rule of thumb)
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spread = np.where(iqr > 0, np.minimum(sd, iqr / 1.34), sd)
+        return 0.9 * spread * count**-0.2
+
+def binned_stats(x, y, bin_width, quantiles=BIN_QUANTILES, kde_points=BIN_KDE_POINTS):
+    ''' Statistics of y per bin of x (only bins with data are kept)
+        Returns a dict of arrays: 'x0', 'x1' (bin bounds), 'count', 'mean', 'sd'
+        (nan for bins with a single value), 'q<q>' for each quantile (e.g. 'q0.5'),
+        'kde_y' (grid of kde_points y values) and 'kde' (density of each bin on
+        the grid, scaled to a max of 1)
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    out = {k: np.zeros(0) for k in ['x0', 'x1', 'count', 'mean', 'sd', 'kde_y'] + [f'q{q}' for q in quantiles]}
+    out['kde'] = np.zeros((0, kde_points))
+    if len(x) == 0:
+        return out
+
+    ## Bin index relative to the first bin with data
+    b_all = np.floor(x / bin_width).astype(np.int64)
+    b_min = b_all.min()
+    b_all -= b_min
+    count = np.bincount(b_all)
+    used = np.flatnonzero(count)
+    count = count[used]
+    y0 = y.mean()
+    s1 = np.bincount(b_all, weights=y - y0)[used]
+    s2 = np.bincount(b_all, weights=(y - y0)**2)[used]
+    mean = s1 / count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sd = np.sqrt(np.maximum(s2 - count * mean**2, 0) / (count - 1))
+
+    ## Quantiles: positions in the data sorted by (bin, y)
+    order = np.argsort(y)
+    b_type = np.uint16 if b_all.max() < 2**16 else np.int64
+    ys = y[order[np.argsort(b_all[order].astype(b_type), kind='stable')]]
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    for q in quantiles:
+        pos = start + q * (count - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, start + count - 1)
+        out[f'q{q}'] = ys[lo] + (pos - lo) * (ys[hi] - ys[lo])
+
+    ## Kernel densities on a grid spanning y (histogram of each bin, smoothed)
+    grid = np.linspace(y.min(), y.max(), kde_points)
+    step = max(grid[1] - grid[0], 1e-12 * max(1., abs(grid[0])))
+    g_idx = np.minimum(np.rint((y - grid[0]) / step).astype(np.int64), kde_points - 1)
+    hist = np.bincount(b_all * kde_points + g_idx, minlength=(b_all.max() + 1) * kde_points)
+    hist = hist.reshape(-1, kde_points)[used].astype(np.float64)
+    q_lo, q_hi = out.get('q0.25'), out.get('q0.75')
+    iqr = q_hi - q_lo if q_lo is not None and q_hi is not None else np.zeros(len(used))
+    h = _kde_bandwidth(count, sd, iqr)
+    kde = hist.copy()
+    for i in np.flatnonzero(h > 0):
+        k = min(kde_points - 1, int(math.ceil(4 * h[i] / step)))
+        kernel = np.exp(-0.5 * (np.arange(-k, k + 1) * step / h[i])**2)
+        kde[i] = np.convolve(hist[i], kernel)[k:k + kde_points]
+    kde /= np.maximum(kde.max(axis=1, keepdims=True), 1e-300)
+
+    out['x0'] = (used + b_min) * float(bin_width)
+    out['x1'] = out['x0'] + bin_width
+    out['count'] = count
+    out['mean'] = mean + y0
+    out['sd'] = sd
+    out['kde_y'] = grid
+    out['kde'] = kde
+    return out
+
+def get_binned_stats(df, xvar, yvar, bin_width):
+    ''' Returns the (cached) binned statistics of a column of a dataset
+    '''
+    return get_derived(df, ('binned_stats', xvar, yvar, float(bin_width)), 
+                       lambda d: binned_stats(d[xvar], d[yvar], bin_width))
+
+####### 2D density ######
+## Number of subjects in the cells of a nx by ny grid over (x, y), for density
+## plots of cohorts too large to scatter. Cell indices are computed directly
+## (no search of the bin edges) and counted with a single np.bincount.
+
+def density_grid(x, y, nx, ny, x_range=None, y_range=None):
+    ''' Counts of (x, y) points in the cells of a grid spanning x_range, y_range
+        (default: the range of the data; points outside the ranges are ignored)
+        Returns (x edges, y edges, counts as an array of shape (ny, nx))
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    if len(x) == 0:
+        return np.zeros(nx + 1), np.zeros(ny + 1), np.zeros((ny, nx), dtype=np.int64)
+    x0, x1 = x_range if x_range is not None else (x.min(), x.max())
+    y0, y1 = y_range if y_range is not None else (y.min(), y.max())
+    x1, y1 = max(x1, x0 + 1e-9), max(y1, y0 + 1e-9)
+    ix = np.floor((x - x0) / (x1 - x0) * nx).astype(np.int64)
+    iy = np.floor((y - y0) / (y1 - y0) * ny).astype(np.int64)
+    ## Points on the upper edges go to the last cells
+    ix[x == x1] = nx - 1
+    iy[y == y1] = ny - 1
+    sel = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    counts = np.bincount(iy[sel] * nx + ix[sel], minlength=nx * ny).reshape(ny, nx)
+    return np.linspace(x0, x1, nx + 1), np.linspace(y0, y1, ny + 1), counts
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
-import math
-import pandas as pd
-import plotly.plotly as py
 import plotly.graph_objs as go
-from sklearn.linear_model import LinearRegression
 from plotly import tools
-import statsmodels.api as sm
 import numpy as np
+from utils_data import get_centile_index, get_derived
+from utils_stats import lowess_fit, get_linreg_table, get_centile_scores, get_binned_stats, density_grid
+from utils_stats import lod_sample
 
 ####### Plot types ######
+## All traces take a gl flag: if set, WebGL (Scattergl) traces are used
+## instead of SVG ones (used for large datasets)
 
-def percentile_trace(df, xvar, yvar, fig):
+def scatter_type(gl=False):
+    ''' Returns the scatter trace class for the render mode
+    '''
+    return go.Scattergl if gl else go.Scatter
+
+def percentile_trace(df, xvar, yvar, fig, gl=False):
     
     cline = ['rgba(255, 255, 255, 0.8)', 'rgba(255, 225, 225, 0.8)', 
              'rgba(255, 187, 187, 0.8)', 'rgba(255, 0, 0, 0.8)',
@@ -20,16 +25,19 @@ def percentile_trace(df, xvar, yvar, fig):
             'rgba(255, 187, 187, 0.3)', 'rgba(255, 0, 0, 0.3)',
             'rgba(255, 0, 0, 0.3)', 'rgba(255, 187, 187, 0.3)', 'rgba(255, 225, 225, 0.3)']
     
-    df_tmp = df[df.ROI == yvar]
+    # Centile curves for the roi (O(1) lookup in the index built once per dataset)
+    band = get_centile_index(df).get(yvar)
+    if band is None:
+        return fig
         
     # Create line traces
-    for i,cvar in enumerate(df.columns[2:]):
+    for i,cvar in enumerate([x for x in band if x != xvar]):
         if i == 0:
-            ctrace = go.Scatter(x = df_tmp[xvar], y = df_tmp[cvar], 
+            ctrace = scatter_type(gl)(x = band[xvar], y = band[cvar], 
                                 mode='lines', name = cvar,
                                 line = dict(color = cline[i]))
         else:
-            ctrace = go.Scatter(x = df_tmp[xvar], y = df_tmp[cvar], 
+            ctrace = scatter_type(gl)(x = band[xvar], y = band[cvar], 
                                 mode='lines', name = cvar, 
                                 line = dict(color = cline[i]),
                                 fill = 'tonexty',
@@ -39,32 +47,172 @@ def percentile_trace(df, xvar, yvar, fig):
 
     return fig
 
-def dots_trace(df, xvar, yvar):
-    trace = go.Scatter(
+def dots_trace(df, xvar, yvar, gl=False):
+    trace = scatter_type(gl)(
         x=df[xvar], y=df[yvar], showlegend=False, mode = 'markers', name = "datapoint",
         line = dict(color = 'rgb(0,160,250)'),
     )
     return trace
 
-def linreg_trace(df, xvar, yvar, fig):
-    model = LinearRegression().fit(np.array(df[xvar]).reshape(-1,1), 
-                                   (np.array(df[yvar])))
-    y_hat = model.predict(np.array(df[xvar]).reshape(-1,1))
-    trace = go.Scatter(
-        x=df[xvar], y=y_hat, showlegend=False, mode = 'lines', name = "linregfit",
+def bar_trace(df, xvar, yvar, gl=False, stat='mean', bin_width=5):
+    # Statistics of yvar per bin of xvar (one bar per bin, cached per dataset),
+    #  the size of the trace depends only on the number of bins
+    #  stat: 'mean' (with SD error bars), 'median' (with IQR error bars) or 'count'
+    #  (no WebGL bar traces: gl is ignored)
+    bins = get_binned_stats(df, xvar, yvar, bin_width)
+    hover = [f"{xvar} {a:g}-{b:g}<br>n = {n}" for a, b, n in zip(bins['x0'], bins['x1'], bins['count'])]
+    if stat == 'count':
+        y, error_y = bins['count'], None
+    elif stat == 'median':
+        y = bins['q0.5']
+        error_y = dict(type = 'data', symmetric = False, 
+                       array = bins['q0.75'] - y, arrayminus = y - bins['q0.25'])
+    else:
+        y = bins['mean']
+        error_y = dict(type = 'data', array = bins['sd'])
+    trace = go.Bar(
+        x=(bins['x0'] + bins['x1']) / 2, y=y, width=bin_width * 0.9, error_y=error_y,
+        text=hover, hoverinfo='y+text', showlegend=False, name = "bin_" + stat,
+        marker = dict(color = 'rgb(0,160,250)'),
+    )
+    return trace
+
+def _bin_hover(bins, xvar):
+    return [
+        f"{xvar} {a:g}-{b:g}<br>n = {n}<br>median {q50:.4g}<br>IQR {q25:.4g} - {q75:.4g}"
+        f"<br>5-95% {q05:.4g} - {q95:.4g}"
+        for a, b, n, q05, q25, q50, q75, q95 in zip(
+            bins['x0'], bins['x1'], bins['count'], 
+            *[bins[f'q{q}'] for q in (0.05, 0.25, 0.5, 0.75, 0.95)])
+    ]
+
+def _shapes_traces(xs, ys, bins, xvar, name):
+    # Polygons and segments (separated by None) drawn as a single filled trace
+    #  (segments have no area, so they are drawn as lines), and a trace of 
+    #  markers at the bin medians for the hover text of each bin
+    shapes = go.Scatter(
+        x=xs, y=ys, mode='lines', fill='toself', hoverinfo='skip', showlegend=False, name=name,
+        line=dict(color='rgb(0,160,250)', width=1), fillcolor='rgba(0,160,250,0.3)',
+    )
+    hover = go.Scatter(
+        x=(bins['x0'] + bins['x1']) / 2, y=bins['q0.5'], text=_bin_hover(bins, xvar), 
+        mode='markers', hoverinfo='text', showlegend=False, name=name + "_median",
+        marker=dict(color='rgb(0,160,250)', size=4),
+    )
+    return [shapes, hover]
+
+def box_trace(df, xvar, yvar, gl=False, bin_width=5):
+    # Box plot of yvar per bin of xvar, from the (cached) bin quantiles: boxes
+    #  from the 25th to the 75th percentile, median line, whiskers to the 5th
+    #  and 95th percentiles (plotly boxes can not be drawn from precomputed
+    #  quantiles, so the geometry is drawn as a scatter trace)
+    bins = get_binned_stats(df, xvar, yvar, bin_width)
+    xs, ys = [], []
+    for i in range(len(bins['count'])):
+        c, w = (bins['x0'][i] + bins['x1'][i]) / 2, 0.35 * bin_width
+        q05, q25, q50, q75, q95 = [bins[f'q{q}'][i] for q in (0.05, 0.25, 0.5, 0.75, 0.95)]
+        shapes = [
+            ([c - w, c + w, c + w, c - w, c - w], [q25, q25, q75, q75, q25]),
+            ([c - w, c + w], [q50, q50]),
+            ([c, c, None, c - w / 2, c + w / 2], [q25, q05, None, q05, q05]),
+            ([c, c, None, c - w / 2, c + w / 2], [q75, q95, None, q95, q95]),
+        ]
+        for sx, sy in shapes:
+            xs += sx + [None]
+            ys += sy + [None]
+    return _shapes_traces(xs, ys, bins, xvar, "box")
+
+def _round_sig(a, digits=5):
+    # Values rounded to a number of significant digits of the largest one
+    #  (shorter JSON for outlines drawn from many points)
+    a = np.asarray(a, dtype=np.float64)
+    top = np.nanmax(np.abs(a)) if len(a) else 0
+    if not top > 0:
+        return a
+    scale = 10.**(digits - 1 - np.floor(np.log10(top)))
+    return np.round(a * scale) / scale
+
+def violin_trace(df, xvar, yvar, gl=False, bin_width=5, min_density=0.01):
+    # Violin plot of yvar per bin of xvar: (cached) kernel density outline of
+    #  each bin, mirrored around the bin centre, with a median line
+    bins = get_binned_stats(df, xvar, yvar, bin_width)
+    grid = bins['kde_y']
+    xs, ys = [], []
+    for i in range(len(bins['count'])):
+        c, w = (bins['x0'][i] + bins['x1'][i]) / 2, 0.45 * bin_width
+        sel = np.flatnonzero(bins['kde'][i] >= min_density)
+        if len(sel) == 0:
+            continue
+        dens = bins['kde'][i][sel[0]:sel[-1] + 1]
+        gy = grid[sel[0]:sel[-1] + 1]
+        ## Median line across the violin (at its width at the median)
+        q50 = bins['q0.5'][i]
+        w50 = w * np.interp(q50, gy, dens)
+        sx = _round_sig(np.concatenate([c + w * dens, c - w * dens[::-1], [c + w * dens[0], np.nan, c - w50, c + w50]]))
+        sy = _round_sig(np.concatenate([gy, gy[::-1], [gy[0], np.nan, q50, q50]]))
+        xs += [None if np.isnan(v) else v for v in sx.tolist()] + [None]
+        ys += [None if np.isnan(v) else v for v in sy.tolist()] + [None]
+    return _shapes_traces(xs, ys, bins, xvar, "violin")
+
+def linreg_trace(df, xvar, yvar, fig, gl=False):
+    # Coefficients are precomputed for all columns; draw a 2-point line
+    fit = get_linreg_table(df, xvar).loc[yvar]
+    x_hat = np.array([fit['x_min'], fit['x_max']])
+    y_hat = fit['intercept'] + fit['slope'] * x_hat
+    trace = scatter_type(gl)(
+        x=x_hat, y=y_hat, showlegend=False, mode = 'lines', name = "linregfit",
         line = dict(color = 'rgb(0,0,255)'),
     )
     fig.append_trace(trace, 1, 1)  # plot in first row
     return fig
 
-def lowess_trace(df, xvar, yvar, fig):
-    lowess = sm.nonparametric.lowess
-
-    #y_hat = lowess(np.array(df[yvar], np.array(df[xvar], frac=1./3)
-    y_hat = lowess(df[yvar], df[xvar], frac=1./3)
-    trace = go.Scatter(
-        x = y_hat[:,0], y=y_hat[:,1], showlegend=False, mode = 'lines', name = "lowessfit",
+def lowess_trace(df, xvar, yvar, fig, gl=False, frac=1./3, progress=None):
+    # Fit on a fixed grid, cached per (dataset, xvar, yvar, frac)
+    x_hat, y_hat = get_derived(df, ('lowess', xvar, yvar, frac), 
+                               lambda d: lowess_fit(d[xvar], d[yvar], frac=frac, progress=progress))
+    trace = scatter_type(gl)(
+        x = x_hat, y=y_hat, showlegend=False, mode = 'lines', name = "lowessfit",
         line = dict(color = 'rgb(0,255,0)'),        
     )
     fig.append_trace(trace, 1, 1)  # plot in first row
     return fig
+
+def density_trace(df, xvar, yvar, fig, gl=False, bins=(100, 60), x_range=None, y_range=None):
+    # Heatmap of the number of subjects in the cells of a grid over the visible
+    #  window (bins: number of cells along x and y, set from the plot size),
+    #  empty cells are transparent
+    #  (no WebGL heatmap in this plotly version: gl is ignored)
+    x_edges, y_edges, counts = density_grid(df[xvar], df[yvar], bins[0], bins[1], x_range, y_range)
+    trace = go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, 
+        z=np.where(counts > 0, counts, None),
+        colorscale='Blues', reversescale=True, showscale=False, zsmooth=False,
+        hoverinfo='x+y+z', name = "density",
+    )
+    fig.append_trace(trace, 1, 1)  # plot in first row
+    return fig
+
+def centile_trace(df, xvar, yvar, fig, gl=False, dset_ref=None, progress=None, 
+                  max_points=None, x_range=None):
+    # Data points coloured by their centile relative to the reference data
+    #  (scores of all rois are computed at once, cached per (dataset, reference))
+    #  max_points: above this number of rows, only a sample of the points of the
+    #  x window x_range is drawn (same sample as the scatter plot)
+    if dset_ref is None or yvar not in get_centile_index(dset_ref):
+        return fig
+    centiles, zscores = get_centile_scores(df, dset_ref, xvar, progress)
+    if max_points is not None and len(df) > max_points:
+        idx = lod_sample(df, xvar, yvar, max_points, x_range)
+    else:
+        idx = np.arange(len(df))
+    cent = centiles[yvar].to_numpy()[idx]
+    trace = scatter_type(gl)(
+        x=df[xvar].to_numpy()[idx], y=df[yvar].to_numpy()[idx], showlegend=False, mode = 'markers', 
+        name = "centile",
+        customdata = np.column_stack([cent, zscores[yvar].to_numpy()[idx]]),
+        hovertemplate = "centile: %{customdata[0]:.1f}<br>z: %{customdata[1]:.2f}<extra></extra>",
+        marker = dict(color = cent, colorscale = 'RdBu', cmin = 0, cmax = 100,
+                      showscale = True, colorbar = dict(title = 'centile')),
+    )
+    fig.append_trace(trace, 1, 1)  # plot in first row
+    return fig